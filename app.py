@@ -5,43 +5,95 @@ Déploiement compatible Vercel
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Any, Union
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional, Any, Union, Tuple, Set
 import os
-from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, ToolMessage
-from services.agent import agent_executor
-from services.tools import TOOLS
-from services.database import db
+import math
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from services._env import ensure_env
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from services.agent import get_agent_executor
+from services.llm_http import warm_up_connections
+from services.tools import TOOLS, close_search_client
+from services.database import Database
 from contextlib import asynccontextmanager
-import json
+from cachetools import TTLCache
+import asyncio
+import hashlib
+import orjson
 
 # Import auth router
 from auth.routes import router as auth_router
+from auth.auth_service import auth_service
+from auth.errors import AuthServiceError, AuthRateLimited
+from auth.rate_limit import OTPRateLimitMiddleware
+
+ensure_env()
+
+
+def _configure_logging() -> None:
+    """
+    Logs : WARNING par défaut en production, LOG_LEVEL=INFO/DEBUG pour le détail.
+    
+    Les handlers écrivent depuis un thread dédié : un log émis dans une route
+    ne bloque jamais la boucle asyncio sur l'I/O de stdout. Rien n'est touché
+    si le processus hôte (uvicorn --log-config, pytest/caplog...) a déjà
+    installé des handlers sur le logger racine.
+    """
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        return
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    atexit.register(listener.stop)
 
-load_dotenv()
+
+_configure_logging()
+logger = logging.getLogger(__name__)
 
 # ============================================================================
 # Événements de démarrage/arrêt (Lifespan)
 # ============================================================================
 
+async def _warm_up_agent():
+    """Construit l'agent et ouvre les connexions LLM sans bloquer le démarrage"""
+    try:
+        get_agent_executor()
+        await warm_up_connections()
+    except Exception as e:
+        logger.warning("Préchauffage de l'agent impossible : %s", e)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestionnaire de cycle de vie de l'application"""
     # Démarrage
-    await db.connect_db()
-    print("✓ QualiAPI démarrée")
-    print("✓ Agent LangGraph initialisé")
-    print("✓ Outils disponibles :")
-    for tool in TOOLS:
-        print(f"  - {tool.name}")
+    await Database.connect_db()
+    await auth_service.connect()
+    warm_up = asyncio.create_task(_warm_up_agent())
+    logger.info(
+        "QualiAPI démarrée, agent LangGraph initialisé, outils : %s",
+        ", ".join(tool.name for tool in TOOLS)
+    )
     
     yield
     
     # Arrêt
-    await db.close_db()
-    print("✓ QualiAPI arrêtée")
+    warm_up.cancel()
+    await Database.close_db()
+    await auth_service.aclose()
+    await close_search_client()
+    logger.info("QualiAPI arrêtée")
 
 
 # Initialiser l'application FastAPI
@@ -49,16 +101,25 @@ app = FastAPI(
     title="QualiAPI - Qualiwo Shopping Assistant",
     description="API conversationnelle avec agent IA pour l'e-commerce Qualiwo",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Configuration CORS (à restreindre en production)
+# Limite par IP des envois d'OTP (SMS payants), avant tout parsing du corps.
+# Ajoutée avant CORS : les réponses 429 gardent leurs en-têtes CORS
+app.add_middleware(OTPRateLimitMiddleware)
+
+# Configuration CORS (à restreindre en production via CORS_ORIGINS)
+_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()] or ["*"]
+
+# "*" avec credentials est invalide selon la spec : Starlette devrait renvoyer
+# l'origine de chaque requête. Sans credentials, l'en-tête "*" reste statique.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=os.getenv("CORS_ORIGINS", "*").split(","),
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=_ORIGINS,
+    allow_credentials="*" not in _ORIGINS,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["authorization", "content-type"],
 )
 
 # Include authentication routes
@@ -74,24 +135,36 @@ async def add_process_time_header(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
-    print(f"⏱️ Latence pour {request.url.path}: {process_time:.4f}s")
+    logger.debug("Latence pour %s: %.4fs", request.url.path, process_time)
     return response
 
 # ============================================================================
 # Modèles Pydantic
 # ============================================================================
 
+# Corps de requête en lecture seule ; les champs inconnus sont ignorés
+# (pas de slots : BaseModel ne les supporte pas)
+_REQUEST_MODEL_CONFIG = ConfigDict(extra="ignore", frozen=True)
+
+
 class Message(BaseModel):
     """Modèle pour un message dans la conversation"""
+    model_config = _REQUEST_MODEL_CONFIG
+    
     role: str  # "user" ou "assistant"
     content: str
 
 
 class ChatRequest(BaseModel):
     """Requête pour l'endpoint /chat"""
+    model_config = _REQUEST_MODEL_CONFIG
+    
     message: str
     session_id: Optional[str] = None
+    # Conservé pour compatibilité : l'historique vient du checkpointer (session_id)
     conversation_history: Optional[List[Message]] = None
+    # Si vrai, ui_action.data vaut {"ref": ...} à récupérer via GET /ui/data/{ref}
+    ui_data_by_ref: bool = False
 
 
 class UIAction(BaseModel):
@@ -107,6 +180,190 @@ class ChatResponse(BaseModel):
     session_id: Optional[str] = None
 
 
+# ============================================================================
+# Cache des réponses
+# ============================================================================
+
+# Dernier tour de recherche de chaque session :
+# session_id -> (checkpoint écrit par le tour, clé du message, réponse).
+# Un hit saute l'agent, donc rien n'est écrit dans le checkpointer : seul le
+# renvoi du dernier message, sans autre tour depuis, est servi depuis le cache.
+# Le checkpoint n'est relu que si le message correspond à l'entrée de la session
+_response_cache: TTLCache = TTLCache(
+    maxsize=10_000,
+    ttl=int(os.getenv("CHAT_CACHE_TTL_SECONDS", "300"))
+)
+
+# Outils sans effet de bord : un tour qui n'appelle que ceux-ci peut être rejoué
+_CACHEABLE_TOOLS = {"product_search_tool"}
+
+
+# Nombre maximum d'exécutions simultanées de l'agent par worker : au-delà, les
+# requêtes attendent leur tour au lieu de saturer le fournisseur LLM (429)
+_agent_slots = asyncio.Semaphore(int(os.getenv("AGENT_MAX_CONCURRENCY", "16")))
+
+
+def _response_cache_key(message: str, by_ref: bool = False) -> str:
+    """Clé d'un message dans l'entrée de cache de sa session"""
+    raw = f"{int(by_ref)}|{message}".encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+async def _thread_checkpoint_id(config: dict) -> Optional[str]:
+    """Identifiant du dernier checkpoint du thread (None si aucun état)"""
+    state = await get_agent_executor().aget_state(config)
+    return (state.config or {}).get("configurable", {}).get("checkpoint_id")
+
+
+# Données UI servies à part (GET /ui/data/{ref}), déjà encodées en JSON
+_UI_DATA_TTL_SECONDS = int(os.getenv("UI_DATA_TTL_SECONDS", "600"))
+_ui_data_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_UI_DATA_TTL_SECONDS)
+
+
+def _ui_data_ref(data: Any) -> Any:
+    """
+    Remplace les données UI par une référence vers le cache.
+    
+    La clé dépend du contenu : une même liste de produits garde la même
+    référence, et le navigateur peut réutiliser sa copie en cache.
+    """
+    if data is None:
+        return None
+    encoded = orjson.dumps(data)
+    key = hashlib.blake2b(encoded, digest_size=8).hexdigest()
+    _ui_data_cache[key] = encoded
+    return {"ref": key}
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def _loads_if_json(content: Any) -> Any:
+    """
+    Décode le contenu d'un ToolMessage uniquement s'il a la forme d'un JSON.
+
+    Les réponses d'erreur des outils sont du texte brut : on évite de lever
+    (et rattraper) une exception de parsing pour chacune d'elles. Le ToolNode
+    sérialise les dicts des outils sans espace initial : le premier caractère
+    suffit, sans copie via lstrip().
+    """
+    if isinstance(content, str) and content[:1] in ("{", "["):
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError as e:
+            logger.warning("Contenu d'outil JSON invalide: %s", e)
+    return content
+
+
+# Type d'action UI déclenché par chaque outil
+_TOOL_TO_UI = {
+    "product_search_tool": "RENDER_PRODUCTS",
+    "show_cart_tool": "RENDER_CART",
+    "collect_user_info_tool": "REQUEST_INFO",
+    "process_payment_tool": "RENDER_PAYMENT",
+}
+
+
+def _extract_products(data: Any) -> Any:
+    """Liste des produits renvoyée par product_search_tool"""
+    if isinstance(data, dict) and "items" in data:
+        return data["items"]
+    return None
+
+
+def _extract_raw(data: Any) -> Any:
+    """Réponse de l'outil transmise telle quelle au frontend"""
+    return data
+
+
+# Données UI extraites du contenu (déjà décodé) de chaque ToolMessage
+_TOOL_EXTRACTORS = {
+    "product_search_tool": _extract_products,
+    "show_cart_tool": _extract_raw,
+    "process_payment_tool": _extract_raw,
+}
+
+
+def _agent_run_args(request: ChatRequest) -> Tuple[dict, dict]:
+    """
+    Entrée et configuration LangGraph pour un message utilisateur.
+    
+    Seul le nouveau message est envoyé : l'historique est conservé par le
+    checkpointer (thread_id basé sur session_id).
+    """
+    agent_input = {"messages": [HumanMessage(content=request.message)]}
+    config = {"configurable": {"thread_id": request.session_id or "default"}}
+    return agent_input, config
+
+
+def _current_turn(messages: List[Any]) -> List[Any]:
+    """
+    Messages du tour en cours : à partir du dernier message utilisateur.
+    
+    Avec le checkpointer, result["messages"] contient tout l'historique de la
+    session ; seuls les appels d'outils de ce tour définissent l'action UI.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i:]
+    return messages
+
+
+def _extract_ui_action(messages: List[Any]) -> Tuple[str, Any, Set[str]]:
+    """
+    Déduit l'action UI à partir des appels d'outils présents dans les messages.
+    
+    Le message de l'agent contient uniquement du texte conversationnel : les
+    données structurées (listes de produits, panier, paiement) sont extraites
+    des appels d'outils réels, plus fiables que le texte généré.
+    
+    Returns:
+        (type d'action UI, données associées, noms des outils appelés)
+    """
+    ui_action_type = "NONE"
+    ui_data = None
+    
+    # Mapping pour relier les réponses d'outils aux appels
+    tool_calls_map = {}
+    # ToolMessages arrivés avant leur appel (ne devrait pas arriver avec LangGraph)
+    pending_tool_messages = {}
+    
+    def read_tool_data(tool_name: Optional[str], content: Any) -> Any:
+        extractor = _TOOL_EXTRACTORS.get(tool_name)
+        if extractor is None:
+            return None
+        # Contenu décodé une seule fois, puis simple transformation par outil
+        return extractor(_loads_if_json(content))
+    
+    # Un seul parcours : appels d'outils et réponses sont traités au fil de l'eau
+    for message in messages:
+        match message:
+            case ToolMessage(tool_call_id=tool_call_id, content=content):
+                tool_name = tool_calls_map.get(tool_call_id)
+                if tool_name is None:
+                    pending_tool_messages[tool_call_id] = content
+                    continue
+                data = read_tool_data(tool_name, content)
+                if data is not None:
+                    ui_data = data
+            case AIMessage(tool_calls=tool_calls) if tool_calls:
+                for tool_call in tool_calls:
+                    tool_id = tool_call.get('id')
+                    tool_name = tool_call.get('name', '')
+                    if tool_id:
+                        tool_calls_map[tool_id] = tool_name
+                    ui_action_type = _TOOL_TO_UI.get(tool_name, ui_action_type)
+    
+    # Résoudre les réponses restées en attente
+    for tool_call_id, content in pending_tool_messages.items():
+        data = read_tool_data(tool_calls_map.get(tool_call_id), content)
+        if data is not None:
+            ui_data = data
+    
+    return ui_action_type, ui_data, set(tool_calls_map.values())
+
+
 # ============================================================================
 # Routes
 # ============================================================================
@@ -127,12 +384,12 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "QualiAPI",
-        "agent_loaded": agent_executor is not None
+        "agent_loaded": get_agent_executor.cache_info().currsize > 0
     }
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest) -> ChatResponse:
+async def chat_endpoint(request: ChatRequest) -> ORJSONResponse:
     """
     Endpoint conversationnel principal
     
@@ -144,51 +401,52 @@ async def chat_endpoint(request: ChatRequest) -> ChatResponse:
         request: ChatRequest contenant le message et l'historique de conversation
     
     Returns:
-        ChatResponse avec le message de l'agent et les actions UI
+        Réponse JSON au format ChatResponse avec le message de l'agent et les actions UI
     
     Raises:
         HTTPException: Si une erreur se produit lors du traitement
     """
+    # Validation du message (isspace évite la copie faite par strip)
+    if not request.message or request.message.isspace():
+        raise HTTPException(
+            status_code=400,
+            detail="Le message ne peut pas être vide"
+        )
+    
     try:
-        # Validation du message
-        if not request.message or len(request.message.strip()) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Le message ne peut pas être vide"
-            )
-        
-        # Construire le contexte de conversation
-        # TODO: Gérer l'historique de conversation pour le contexte
-        conversation_context = ""
-        if request.conversation_history:
-            for msg in request.conversation_history[-10:]:  # Derniers 10 messages
-                conversation_context += f"{msg.role}: {msg.content}\n"
-        
-        # Exécuter l'agent LangGraph
-        # Préparer les messages pour LangGraph
+        # L'historique est conservé côté serveur par le checkpointer LangGraph
+        # (thread_id = session_id) : conversation_history n'est pas renvoyé au modèle
         
-        messages = [HumanMessage(content=request.message)]
+        agent_input, config = _agent_run_args(request)
         
-        # Configuration pour la mémoire (thread_id basé sur session_id)
-        config = {"configurable": {"thread_id": request.session_id or "default"}}
+        # Renvoi du dernier message de cette session : sa réponse est déjà
+        # enregistrée dans le checkpointer, on la resert telle quelle.
+        # Sans session_id, le thread "default" est partagé : pas de cache
+        message_key = _response_cache_key(request.message, request.ui_data_by_ref)
+        cached = _response_cache.get(request.session_id) if request.session_id is not None else None
+        if (
+            cached is not None
+            and cached[1] == message_key
+            and cached[0] == await _thread_checkpoint_id(config)
+        ):
+            return ORJSONResponse(cached[2])
         
-        # Exécuter l'agent
+        # Exécuter l'agent LangGraph
         start_agent = time.time()
-        print(f"🚀 Starting agent execution for session {request.session_id}")
-        result = await agent_executor.ainvoke({"messages": messages}, config=config)
+        logger.debug("Starting agent execution for session %s", request.session_id)
+        async with _agent_slots:
+            result = await get_agent_executor().ainvoke(agent_input, config=config)
         agent_duration = time.time() - start_agent
-        print(f"🤖 Agent execution took: {agent_duration:.4f}s")
+        logger.debug("Agent execution took: %.4fs", agent_duration)
 
         # --- DEBUG LOGGING ---
-        print("📊 Agent Result Analysis:")
-        if "messages" in result:
+        if logger.isEnabledFor(logging.DEBUG) and "messages" in result:
             for i, msg in enumerate(result["messages"]):
-                print(f"  Message {i} ({type(msg).__name__}):")
-                print(f"    Content: {str(msg.content)[:200]}...")
-                if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                    print(f"    🛠️ Tool Calls: {msg.tool_calls}")
-                if hasattr(msg, 'tool_call_id'):
-                    print(f"    🆔 Tool Call ID: {msg.tool_call_id}")
+                logger.debug(
+                    "Message %d (%s): %.200s tool_calls=%s tool_call_id=%s",
+                    i, type(msg).__name__, msg.content,
+                    getattr(msg, "tool_calls", None), getattr(msg, "tool_call_id", None)
+                )
         # ---------------------
         
         # Extraire la réponse du dernier message AI
@@ -198,99 +456,36 @@ async def chat_endpoint(request: ChatRequest) -> ChatResponse:
             agent_output = last_message.content if hasattr(last_message, 'content') else str(last_message)
         
         # Détecter les actions UI basées sur les outils appelés dans les messages
-        ui_action_type = "NONE"
-        ui_data = None
-
-        # --- LOGIQUE DE PARSING JSON ---
-        # Le prompt demande à l'agent de répondre en JSON. On tente de l'extraire pour le frontend.
-        # Note: Le message contient uniquement du texte conversationnel
-        # Les données structurées (JSON, listes de produits, etc.) doivent être
-        # extraites à partir des appels d'outils, pas du message
-        # Voir la section "LOGIQUE DE DÉTECTION PAR OUTILS" ci-dessous
-        
-        # --- LOGIQUE DE DÉTECTION PAR OUTILS ---
-        # On complète/écrase avec les infos issues des appels d'outils réels
-        # (plus fiable pour les données comme les listes de produits)
-        
-        # Mapping pour relier les réponses d'outils aux appels
-        tool_calls_map = {}
-        
-        # 1. Identifier les appels d'outils et définir le type d'action
-        for message in result["messages"]:
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                for tool_call in message.tool_calls:
-                    tool_id = tool_call.get('id')
-                    tool_name = tool_call.get('name', '')
-                    if tool_id:
-                        tool_calls_map[tool_id] = tool_name
-                    
-                    if tool_name == "product_search_tool":
-                        ui_action_type = "RENDER_PRODUCTS"
-                    elif tool_name == "show_cart_tool":
-                        ui_action_type = "RENDER_CART"
-                    elif tool_name == "collect_user_info_tool":
-                        ui_action_type = "REQUEST_INFO"
-                    elif tool_name == "process_payment_tool":
-                        ui_action_type = "RENDER_PAYMENT"
-
-        # 2. Récupérer les données des ToolMessages
-        for message in result["messages"]:
-            if isinstance(message, ToolMessage):
-                tool_name = tool_calls_map.get(message.tool_call_id)
-                
-                if tool_name == "product_search_tool":
-                    try:
-                        content = message.content
-                        data = content
-                        if isinstance(content, str):
-                            try:
-                                data = json.loads(content)
-                            except:
-                                pass
-                        
-                        if isinstance(data, dict) and "items" in data:
-                            ui_data = data["items"]
-                    except Exception as e:
-                        print(f"Erreur parsing product_search_tool: {e}")
-                        
-                elif tool_name == "show_cart_tool":
-                    try:
-                        content = message.content
-                        data = content
-                        if isinstance(content, str):
-                            try:
-                                data = json.loads(content)
-                            except:
-                                pass
-                        ui_data = data
-                    except Exception as e:
-                        print(f"Erreur parsing show_cart_tool: {e}")
-
-                elif tool_name == "process_payment_tool":
-                    try:
-                        content = message.content
-                        data = content
-                        if isinstance(content, str):
-                            try:
-                                data = json.loads(content)
-                            except:
-                                pass
-                        ui_data = data
-                    except Exception as e:
-                        print(f"Erreur parsing process_payment_tool: {e}")
+        ui_action_type, ui_data, tools_called = _extract_ui_action(_current_turn(result["messages"]))
+        if request.ui_data_by_ref:
+            ui_data = _ui_data_ref(ui_data)
         
         # Construire la réponse
-        response = ChatResponse(
-            message=agent_output,
-            ui_action=UIAction(type=ui_action_type, data=ui_data),
-            session_id=request.session_id
-        )
+        # On renvoie directement une ORJSONResponse : FastAPI saute alors la
+        # validation/sérialisation par ChatResponse, qui ne sert plus qu'à la doc OpenAPI
+        payload = {
+            "message": agent_output,
+            "ui_action": {"type": ui_action_type, "data": ui_data},
+            "session_id": request.session_id
+        }
         
-        return response
+        # Ne mettre en cache que les tours de recherche (pas de panier/paiement,
+        # ni les réponses sans outil qui dépendent de l'historique)
+        if request.session_id is not None:
+            if tools_called and tools_called <= _CACHEABLE_TOOLS:
+                _response_cache[request.session_id] = (
+                    await _thread_checkpoint_id(config), message_key, payload
+                )
+            else:
+                # Ce tour a avancé le thread : l'entrée précédente ne peut plus servir
+                _response_cache.pop(request.session_id, None)
+        
+        return ORJSONResponse(payload)
     
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Erreur /chat session=%s", request.session_id)
         raise HTTPException(
             status_code=500,
             detail=f"Erreur lors du traitement du message : {str(e)}"
@@ -298,51 +493,83 @@ async def chat_endpoint(request: ChatRequest) -> ChatResponse:
 
 
 from fastapi.responses import StreamingResponse
-import asyncio
 
 @app.post("/chat/stream")
 async def chat_stream_endpoint(request: ChatRequest):
     """
     Endpoint pour le streaming de réponses via Server-Sent Events (SSE)
+    
+    Les tokens sont envoyés dès leur génération ; l'action UI du tour
+    (même logique que /chat) est envoyée dans une trame finale "ui_action".
     """
-    if not request.message or len(request.message.strip()) == 0:
+    if not request.message or request.message.isspace():
         raise HTTPException(status_code=400, detail="Le message ne peut pas être vide")
 
-    messages = [HumanMessage(content=request.message)]
-    config = {"configurable": {"thread_id": request.session_id or "default"}}
+    agent_input, config = _agent_run_args(request)
 
     async def event_generator():
         try:
-            # On utilise astream pour récupérer les chunks en temps réel
-            # Note: Avec create_react_agent, on reçoit des updates d'état
-            async for event in agent_executor.astream_events(
-                {"messages": messages}, 
-                config=config,
-                version="v2"
-            ):
-                kind = event["event"]
-                
-                # On stream les tokens générés par le LLM (content)
-                if kind == "on_chat_model_stream":
-                    content = event["data"]["chunk"].content
-                    if content:
-                        yield f"data: {json.dumps({'type': 'content', 'value': content})}\n\n"
-                
-                # On peut aussi streamer les débuts d'appels d'outils pour l'UX
-                elif kind == "on_tool_start":
-                    yield f"data: {json.dumps({'type': 'tool_start', 'tool': event['name']})}\n\n"
+            # "messages" : tokens du LLM au fil de l'eau
+            # "updates"  : messages complets produits par chaque noeud, pour l'action UI finale
+            turn_messages = []
+            async with _agent_slots:
+                async for mode, chunk in get_agent_executor().astream(
+                    agent_input,
+                    config=config,
+                    stream_mode=["messages", "updates"]
+                ):
+                    if mode == "messages":
+                        message_chunk, _metadata = chunk
+                        if not isinstance(message_chunk, AIMessage):
+                            continue
                     
-                elif kind == "on_tool_end":
-                    # On pourrait envoyer les résultats partiels ici
-                    pass
-
+                        # On stream les tokens générés par le LLM (content)
+                        if message_chunk.content:
+                            yield f"data: {orjson.dumps({'type': 'content', 'value': message_chunk.content}).decode()}\n\n"
+                    
+                        # On signale les débuts d'appels d'outils pour l'UX
+                        # (fragments pour un modèle en streaming, appels complets sinon)
+                        tool_calls = getattr(message_chunk, "tool_call_chunks", None) or message_chunk.tool_calls
+                        for tool_call in tool_calls:
+                            if tool_call.get("name"):
+                                yield f"data: {orjson.dumps({'type': 'tool_start', 'tool': tool_call['name']}).decode()}\n\n"
+                
+                    elif mode == "updates":
+                        for update in chunk.values():
+                            if isinstance(update, dict):
+                                turn_messages.extend(update.get("messages", []))
+
+            # Action UI du tour, calculée comme pour /chat
+            ui_action_type, ui_data, _ = _extract_ui_action(turn_messages)
+            if request.ui_data_by_ref:
+                ui_data = _ui_data_ref(ui_data)
+            yield f"data: {orjson.dumps({'type': 'ui_action', 'value': {'type': ui_action_type, 'data': ui_data}}).decode()}\n\n"
+            
             yield "data: [DONE]\n\n"
         except Exception as e:
+            logger.exception("Erreur /chat/stream session=%s", request.session_id)
             error_msg = f"Erreur streaming: {str(e)}"
-            yield f"data: {json.dumps({'type': 'error', 'value': error_msg})}\n\n"
+            yield f"data: {orjson.dumps({'type': 'error', 'value': error_msg}).decode()}\n\n"
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+@app.get("/ui/data/{key}")
+async def ui_data_endpoint(key: str):
+    """
+    Données d'une action UI envoyée par référence (ui_data_by_ref)
+    
+    Le contenu d'une référence ne change jamais : le navigateur peut le garder
+    en cache pendant toute la durée de vie de l'entrée.
+    """
+    encoded = _ui_data_cache.get(key)
+    if encoded is None:
+        raise HTTPException(status_code=404, detail="Données UI introuvables ou expirées")
+    return Response(
+        content=encoded,
+        media_type="application/json",
+        headers={"Cache-Control": f"private, max-age={_UI_DATA_TTL_SECONDS}"}
+    )
+
 # ============================================================================
 # Error Handlers
 # ============================================================================
@@ -356,12 +583,34 @@ async def http_exception_handler(request, exc):
     )
 
 
+@app.exception_handler(AuthServiceError)
+async def auth_exception_handler(request, exc: AuthServiceError):
+    """
+    Handler des erreurs typées du service d'authentification
+    Le statut vient de l'exception (401, 429, 503...), 400 par défaut
+    """
+    status_code = exc.status_code or 400
+    headers = None
+    if isinstance(exc, AuthRateLimited) and exc.retry_after is not None:
+        headers = {"Retry-After": str(math.ceil(exc.retry_after))}
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"error": exc.message, "status_code": status_code},
+        headers=headers
+    )
+
+
+# Corps constant de l'erreur 500, encodé une seule fois
+_INTERNAL_ERROR_BODY = orjson.dumps({"error": "Erreur interne du serveur", "status_code": 500})
+
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """Handler pour les exceptions générales"""
-    return JSONResponse(
+    return Response(
+        content=_INTERNAL_ERROR_BODY,
         status_code=500,
-        content={"error": "Erreur interne du serveur", "status_code": 500}
+        media_type="application/json"
     )
 
 
@@ -372,12 +621,18 @@ async def general_exception_handler(request, exc):
 # C'est ce qui est utilisé pour gérer les requêtes sur Vercel
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
     
-    # Pour développement local
+    # Pour exécution locale / serveur (uvloop + httptools via uvicorn[standard])
+    # Le rechargement automatique n'est possible qu'avec un seul worker
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8000)),
-        reload=True
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop n'existe pas sous Windows
+        http="httptools",
+        workers=workers,
+        reload=workers == 1
     )
@@ -4,12 +4,117 @@ Handles phone authentication, OTP sending/verification, and session management
 """
 
 import os
-from typing import Dict, Any, Optional
-from supabase import create_client, Client
+import time
+import asyncio
+import hashlib
+import random
+import logging
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable, TypeVar
+import httpx
+from cachetools import TTLCache
+from jose import jwt, JWTError
+from supabase import acreate_client, AsyncClient, AsyncClientOptions, AuthError, AuthApiError, AuthRetryableError
 from dotenv import load_dotenv
+from .rate_limit import otp_send_limiter, otp_verify_limiter
+from .models import FormattedUser, SessionData
+from .errors import (
+    AuthServiceError,
+    AuthInvalidCredentials,
+    AuthRateLimited,
+    AuthUnavailable,
+    OTPSendError,
+    OTPVerifyError,
+    TokenRefreshError,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# get_user results are reused for at most this long (and never past the token's exp)
+USER_CACHE_TTL_SECONDS = 60
+
+# Shared Supabase connection pool, sized for ~100 concurrent auth requests
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "50"))
+
+T = TypeVar("T")
+
+# User attributes merged into the formatted metadata, in increasing priority
+_META_ATTRS = ("user_metadata", "raw_user_meta_data", "app_metadata")
+
+
+def _is_transient(error: Exception) -> bool:
+    """Rate limits, 5xx and network failures are worth retrying; other 4xx are not"""
+    if isinstance(error, (AuthRetryableError, httpx.TransportError)):
+        return True
+    if isinstance(error, AuthApiError):
+        return error.status == 429 or error.status >= 500
+    return False
+
+
+def _never_sent(error: Exception) -> bool:
+    """
+    The connection failed before the request went out, so GoTrue never saw it
+    
+    Only these are safe to retry for calls with side effects: a timeout or 5xx
+    after sending may have texted the code, or consumed the OTP.
+    """
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+# GoTrue error codes meaning "bad credentials / token", answered with a 401
+_INVALID_CREDENTIAL_CODES = frozenset({
+    "invalid_credentials", "otp_expired", "bad_jwt", "invalid_jwt",
+    "session_not_found", "session_expired", "user_not_found",
+    "refresh_token_not_found", "refresh_token_already_used",
+})
+
+# SDK/transport failures translated by _service_error
+_SDK_ERRORS = (AuthError, httpx.TransportError)
+
+
+def _service_error(error: Exception, action: str, fallback: type = AuthServiceError) -> AuthServiceError:
+    """
+    Translate an SDK or transport error into a typed AuthServiceError
+    
+    fallback is the class used when the error has no specific HTTP meaning.
+    """
+    message = f"{action}: {getattr(error, 'message', error)}"
+    status = getattr(error, "status", None)
+    code = getattr(error, "code", None)
+    
+    if status == 429 or (code and code.startswith("over_")):
+        return AuthRateLimited(message)
+    if isinstance(error, (AuthRetryableError, httpx.TransportError)) or (status and status >= 500):
+        return AuthUnavailable(message)
+    if code in _INVALID_CREDENTIAL_CODES or status in (401, 403):
+        return AuthInvalidCredentials(message)
+    return fallback(message)
+
+
+async def _with_retry(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    max_retries: int = 3,
+    base: float = 0.2,
+    cap: float = 8.0,
+    retry_if: Callable[[Exception], bool] = _is_transient,
+) -> T:
+    """
+    Run a GoTrue call, retrying transient failures with exponential backoff
+    and full jitter: sleep uniform(0, min(cap, base * 2 ** attempt)).
+    
+    retry_if decides which errors are retried (_never_sent for non-idempotent calls).
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == max_retries or not retry_if(e):
+                raise
+            await asyncio.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
 
 class AuthService:
     """Service for handling Supabase authentication operations"""
@@ -24,18 +129,110 @@ class AuthService:
                 "SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables"
             )
         
-        self.client: Client = create_client(supabase_url, supabase_key)
+        self._url = supabase_url
+        self._key = supabase_key
+        # One keep-alive HTTP/2 pool for every Supabase client of this service,
+        # scoped ones included: TLS handshakes are paid once, not per request
+        self._http = self._new_http_pool()
+        # Validated users keyed by token hash: (expires_at, formatted user)
+        self._user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+        # In-flight refreshes keyed by refresh-token hash (single-flight)
+        self._refresh_inflight: Dict[str, asyncio.Task] = {}
+        # Shared client, created by connect() at startup or on first use: only
+        # used for calls that never read a stored session
+        self.client: Optional[AsyncClient] = None
+        self._connect_lock = asyncio.Lock()
+    
+    @staticmethod
+    def _new_http_pool() -> httpx.AsyncClient:
+        """Keep-alive HTTP/2 pool shared by the Supabase clients"""
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=1800,
+            ),
+            timeout=10,
+        )
+    
+    async def connect(self) -> None:
+        """Create the shared async Supabase client (application startup)"""
+        async with self._connect_lock:
+            if self.client is None:
+                self.client = await acreate_client(self._url, self._key, options=self._client_options())
+    
+    async def _shared_client(self) -> AsyncClient:
+        """
+        Shared client, connected on first use: serverless invocations may
+        skip the lifespan that calls connect()
+        """
+        if self.client is None:
+            await self.connect()
+        return self.client
+    
+    def _client_options(self) -> AsyncClientOptions:
+        """Server-side options: shared HTTP pool, no session storage, no background token refresh"""
+        return AsyncClientOptions(
+            persist_session=False,
+            auto_refresh_token=False,
+            httpx_client=self._http,
+            postgrest_client_timeout=10,
+        )
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP pool (application shutdown)"""
+        await self._http.aclose()
+        # A later connect() builds a new client on a new pool, never the closed one
+        self.client = None
+        self._http = self._new_http_pool()
     
-    def _format_user(self, user) -> Dict[str, Any]:
+    async def _scoped_client(self) -> AsyncClient:
+        """
+        Short-lived client for every call that creates or uses a user session
+        (sign-up, sign-in, OTP verification, refresh, update_user).
+        
+        The session is set on this instance only, so concurrent requests
+        never see each other's tokens and the shared client never holds one.
+        """
+        return await acreate_client(self._url, self._key, options=self._client_options())
+    
+    @staticmethod
+    def _token_key(access_token: str) -> str:
+        """Cache key for a token: a hash, so raw JWTs are not kept in memory"""
+        return hashlib.blake2b(access_token.encode(), digest_size=16).hexdigest()
+    
+    def _cache_user(self, access_token: str, user: Dict[str, Any]) -> None:
+        """Remember a user validated by GoTrue until min(TTL, token exp)"""
+        try:
+            exp = jwt.get_unverified_claims(access_token).get("exp")
+        except JWTError:
+            return
+        now = time.time()
+        if not exp or exp <= now:
+            return
+        expires_at = min(now + USER_CACHE_TTL_SECONDS, exp)
+        self._user_cache[self._token_key(access_token)] = (expires_at, user)
+    
+    def _invalidate_user(self, access_token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        """Drop cached entries for a token, or for every token of a user"""
+        if access_token:
+            self._user_cache.pop(self._token_key(access_token), None)
+        if user_id:
+            for key, (_, user) in list(self._user_cache.items()):
+                if user.get("id") == user_id:
+                    self._user_cache.pop(key, None)
+    
+    def _format_user(self, user) -> FormattedUser:
         """Helper to format user object with metadata"""
         if not user:
             return {}
             
-        # Exhaustive metadata check
+        # Exhaustive metadata check, later sources win (app_metadata last)
         metadata = {}
-        for attr in ["user_metadata", "raw_user_meta_data", "app_metadata"]:
+        for attr in _META_ATTRS:
             val = getattr(user, attr, None)
-            if val and isinstance(val, dict):
+            if val:
                 metadata.update(val)
         
         # Priority mapping
@@ -50,38 +247,37 @@ class AuthService:
             "last_sign_in_at": getattr(user, "last_sign_in_at", None)
         }
     
+    def _format_session(self, session, user=None) -> SessionData:
+        """Helper to format a Supabase session (plus its user when given)"""
+        data: SessionData = {
+            "access_token": session.access_token,
+            "refresh_token": session.refresh_token,
+            "expires_in": session.expires_in,
+            "expires_at": session.expires_at,
+            "token_type": "bearer"
+        }
+        if user is not None:
+            data["user"] = self._format_user(user)
+        return data
+    
     async def sign_up(self, phone: str, password: str, display_name: str = None) -> Dict[str, Any]:
         """
         Register a new user with phone and password
         """
         try:
-            # Prepare metadata
-            user_metadata = {}
-            if display_name:
-                user_metadata["display_name"] = display_name
-                
+            # supabase-py 2.x: metadata goes under options.data
             credentials = {
                 "phone": phone,
                 "password": password,
                 "options": {
-                    "data": user_metadata
+                    "data": {"display_name": display_name} if display_name else {}
                 }
             }
             
-            try:
-                response = self.client.auth.sign_up(credentials)
-            except Exception as e:
-                # Supabase might raise an exception for duplicates depending on config
-                # We do NOT raise an error here, so the frontend sees a "success" and prompts for validation.
-                # If the user is unverified, this OTP will verify them.
-                # If the user is verified, this OTP will log them in (if type=sms/magiclink).
-                if "already registered" in str(e) or "User already exists" in str(e):
-                    # This means the user already exists, but Supabase still sends an OTP.
-                    # We'll proceed as if it was a successful sign-up, but indicate it's an existing user.
-                    # The frontend should then prompt for OTP verification.
-                    pass # Allow to fall through to the success message, as an OTP is still sent.
-                else:
-                    raise Exception(f"Supabase sign_up failed: {str(e)}")
+            # Duplicates are detected below (STRICT MODE); any SDK error is a real failure.
+            # Scoped client: with phone confirmations off, sign-up returns (and stores) a session
+            client = await self._scoped_client()
+            response = await client.auth.sign_up(credentials)
             
             # CRITICAL CHECK for "Silent" Existing Users
             # Supabase behavior:
@@ -93,7 +289,7 @@ class AuthService:
                 # STRICT MODE: If Supabase returns a user without identities, it means the user exists (verified or not).
                 # We block this to prevent confusion (like signing up again and thinking you set a new password).
                 # The user must use Login or Forgot Password.
-                raise Exception("User already registered. Please log in or use Password Recovery.")
+                raise AuthServiceError("Failed to sign up: User already registered. Please log in or use Password Recovery.")
 
             formatted_user = self._format_user(response.user)
             
@@ -106,31 +302,26 @@ class AuthService:
                 "message": "User created/found. Please verify your phone number with the OTP sent.",
                 "user": formatted_user
             }
-        except Exception as e:
-            raise Exception(f"Failed to sign up: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to sign up") from e
 
-    async def sign_in_with_password(self, phone: str, password: str) -> Dict[str, Any]:
+    async def sign_in_with_password(self, phone: str, password: str) -> SessionData:
         """
         Sign in with phone and password
         """
         try:
-            response = self.client.auth.sign_in_with_password({
+            client = await self._scoped_client()
+            response = await _with_retry(lambda: client.auth.sign_in_with_password({
                 "phone": phone,
                 "password": password
-            })
+            }))
             
             if not response.session:
-                raise Exception("Login failed: No session created")
+                raise AuthInvalidCredentials("Login failed: No session created")
                 
-            return {
-                "access_token": response.session.access_token,
-                "refresh_token": response.session.refresh_token,
-                "expires_in": response.session.expires_in,
-                "token_type": "bearer",
-                "user": self._format_user(response.user)
-            }
-        except Exception as e:
-            raise Exception(f"Login failed: {str(e)}")
+            return self._format_session(response.session, response.user)
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Login failed", AuthInvalidCredentials) from e
     
     async def send_otp(self, phone_number: str) -> Dict[str, Any]:
         """
@@ -143,22 +334,26 @@ class AuthService:
             Dictionary with success status and message
             
         Raises:
-            Exception: If OTP sending fails
+            OTPSendError: If OTP sending fails
+            AuthRateLimited: If too many OTPs were sent to this number
         """
+        otp_send_limiter.take(phone_number)
         try:
-            response = self.client.auth.sign_in_with_otp({
+            client = await self._shared_client()
+            # Not idempotent (each call texts a code): only retried if never sent
+            response = await _with_retry(lambda: client.auth.sign_in_with_otp({
                 "phone": phone_number
-            })
+            }), retry_if=_never_sent)
             
             return {
                 "success": True,
                 "message": "OTP sent successfully",
                 "phone_number": phone_number
             }
-        except Exception as e:
-            raise Exception(f"Failed to send OTP: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to send OTP", OTPSendError) from e
     
-    async def verify_otp(self, phone_number: str, otp: str, type: str = "sms", password: str = None) -> Dict[str, Any]:
+    async def verify_otp(self, phone_number: str, otp: str, type: str = "sms", password: str = None) -> SessionData:
         """
         Verify OTP code and create session.
         Optionally updates the password if provided (Seamless Signup/Reset flow).
@@ -171,38 +366,51 @@ class AuthService:
             
         Returns:
             Dictionary with session data
+            
+        Raises:
+            AuthRateLimited: If too many codes were tried for this number
         """
+        otp_verify_limiter.take(phone_number)
         try:
-            response = self.client.auth.verify_otp({
+            # Verifying stores the new session on the client (reused by
+            # update_user when a password is given): never the shared one
+            client = await self._scoped_client()
+            # An OTP is single-use: a retry after GoTrue consumed it would fail
+            response = await _with_retry(lambda: client.auth.verify_otp({
                 "phone": phone_number,
                 "token": otp,
                 "type": type
-            })
+            }), retry_if=_never_sent)
             
             if not response.session:
-                raise Exception("Failed to create session")
+                raise OTPVerifyError("Failed to verify OTP: Failed to create session")
             
-            # If a new password was provided (e.g. from a retry signup flow), update it now!
+            session = self._format_session(response.session, response.user)
+            
+            # If a new password was provided (e.g. from a retry signup flow), update it now.
+            # Awaited before answering: the client is told whether it was saved
             if password:
-                try:
-                    # We have a valid session now, so we can update the user
-                    self.client.auth.set_session(response.session.access_token, response.session.refresh_token)
-                    self.client.auth.update_user({"password": password})
-                except Exception as pw_error:
-                    print(f"WARNING: Failed to update password during verify: {pw_error}")
-                    # We don't fail the verification itself, but we might want to log this.
+                session["password_updated"] = await self._sync_password(client, password)
 
-            return {
-                "access_token": response.session.access_token,
-                "refresh_token": response.session.refresh_token,
-                "expires_in": response.session.expires_in,
-                "token_type": "bearer",
-                "user": self._format_user(response.user)
-            }
-        except Exception as e:
-            raise Exception(f"Failed to verify OTP: {str(e)}")
+            return session
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to verify OTP", OTPVerifyError) from e
+    
+    async def _sync_password(self, client: AsyncClient, password: str) -> bool:
+        """
+        Set the password on a scoped client that holds the verified session
+
+        Returns False when the update failed: the verification itself still
+        succeeds (the session is valid), the response reports the failure.
+        """
+        try:
+            await client.auth.update_user({"password": password})
+            return True
+        except _SDK_ERRORS as pw_error:
+            logger.warning("Failed to update password during OTP verification: %s", pw_error)
+            return False
     
-    async def refresh_session(self, refresh_token: str) -> Dict[str, Any]:
+    async def refresh_session(self, refresh_token: str) -> SessionData:
         """
         Refresh access token using refresh token
         
@@ -213,22 +421,33 @@ class AuthService:
             Dictionary with new session data
             
         Raises:
-            Exception: If token refresh fails
+            TokenRefreshError: If token refresh fails
+        
+        Concurrent calls with the same refresh token share a single GoTrue
+        request: refresh tokens are single-use, so racing refreshes would
+        revoke each other.
         """
+        key = self._token_key(refresh_token)
+        task = self._refresh_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._do_refresh(refresh_token))
+            self._refresh_inflight[key] = task
+            task.add_done_callback(lambda _: self._refresh_inflight.pop(key, None))
+        # shield: a caller that disconnects must not cancel the others' refresh
+        return await asyncio.shield(task)
+    
+    async def _do_refresh(self, refresh_token: str) -> SessionData:
+        """Single GoTrue refresh call behind refresh_session"""
         try:
-            response = self.client.auth.refresh_session(refresh_token)
+            client = await self._scoped_client()
+            response = await _with_retry(lambda: client.auth.refresh_session(refresh_token))
             
             if not response.session:
-                raise Exception("Failed to refresh session")
+                raise TokenRefreshError("Failed to refresh session: no session returned")
             
-            return {
-                "access_token": response.session.access_token,
-                "refresh_token": response.session.refresh_token,
-                "expires_in": response.session.expires_in,
-                "token_type": "bearer"
-            }
-        except Exception as e:
-            raise Exception(f"Failed to refresh session: {str(e)}")
+            return self._format_session(response.session)
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to refresh session", TokenRefreshError) from e
     
     async def sign_out(self, access_token: str) -> Dict[str, Any]:
         """
@@ -241,23 +460,28 @@ class AuthService:
             Dictionary with success status
             
         Raises:
-            Exception: If sign out fails
+            AuthServiceError: If sign out fails
         """
         try:
-            # Set the session for the client
-            self.client.auth.set_session(access_token, access_token)
+            self._invalidate_user(access_token=access_token)
             
-            # Sign out
-            self.client.auth.sign_out()
+            # Revoke the session directly with the user's JWT: no set_session,
+            # so the shared client holds no per-user state
+            try:
+                client = await self._shared_client()
+                await client.auth.admin.sign_out(access_token)
+            except AuthApiError:
+                # Same as client.auth.sign_out(): an already invalid token is not an error
+                pass
             
             return {
                 "success": True,
                 "message": "Signed out successfully"
             }
-        except Exception as e:
-            raise Exception(f"Failed to sign out: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to sign out") from e
     
-    async def get_user(self, access_token: str) -> Dict[str, Any]:
+    async def get_user(self, access_token: str) -> FormattedUser:
         """
         Get current user information
         
@@ -268,21 +492,25 @@ class AuthService:
             Dictionary with user information
             
         Raises:
-            Exception: If user retrieval fails
+            AuthServiceError: If user retrieval fails
         """
+        cached: Optional[Tuple[float, Dict[str, Any]]] = self._user_cache.get(self._token_key(access_token))
+        if cached and cached[0] > time.time():
+            return dict(cached[1])
+        
         try:
-            # Set the session for the client
-            self.client.auth.set_session(access_token, access_token)
-            
-            # Get user
-            response = self.client.auth.get_user()
+            # Stateless lookup: the JWT is passed per call instead of via set_session
+            client = await self._shared_client()
+            response = await client.auth.get_user(access_token)
             
-            if not response.user:
-                raise Exception("User not found")
+            if not response or not response.user:
+                raise AuthInvalidCredentials("Failed to get user: User not found")
             
-            return self._format_user(response.user)
-        except Exception as e:
-            raise Exception(f"Failed to get user: {str(e)}")
+            user = self._format_user(response.user)
+            self._cache_user(access_token, user)
+            return dict(user)
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to get user") from e
 
     async def reset_password_after_otp(self, phone: str, otp: str, new_password: str) -> Dict[str, Any]:
         """
@@ -290,43 +518,46 @@ class AuthService:
         1. Verify OTP to get a temporary session
         2. Update password using that session
         """
+        otp_verify_limiter.take(phone)
         try:
             # 1. Verify OTP (type="sms" or type="recovery" depending on Supabase config, 
             # usually for phone recovery it might be 'sms')
-            verify_response = self.client.auth.verify_otp({
+            # Scoped client: verify_otp stores the session on it for the update
+            client = await self._scoped_client()
+            verify_response = await client.auth.verify_otp({
                 "phone": phone,
                 "token": otp,
                 "type": "sms"
             })
             
             if not verify_response.session:
-                raise Exception("OTP verification failed, no session created")
-            
-            # 2. Set session for the update
-            self.client.auth.set_session(verify_response.session.access_token, verify_response.session.refresh_token)
+                raise AuthServiceError("Failed to reset password: OTP verification failed, no session created")
             
-            # 3. Update password
-            update_response = self.client.auth.update_user({
+            # 2. Update password with the session held by the scoped client
+            update_response = await client.auth.update_user({
                 "password": new_password
             })
+            self._invalidate_user(user_id=update_response.user.id)
             
             return {
                 "success": True,
                 "message": "Password updated successfully",
                 "user_id": update_response.user.id
             }
-        except Exception as e:
-            raise Exception(f"Failed to reset password: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to reset password") from e
 
     async def initiate_phone_change(self, access_token: str, new_phone: str) -> Dict[str, Any]:
         """
         Initiate phone number change.
         This sends a verification code to the NEW phone number.
         """
+        otp_send_limiter.take(new_phone)
         try:
-            self.client.auth.set_session(access_token, access_token)
+            client = await self._scoped_client()
+            await client.auth.set_session(access_token, access_token)
             # update_user will trigger a verification SMS to the new phone
-            response = self.client.auth.update_user({
+            response = await client.auth.update_user({
                 "phone": new_phone
             })
             return {
@@ -334,31 +565,36 @@ class AuthService:
                 "message": f"Verification code sent to {new_phone}. Please verify to complete the change.",
                 "user": response.user
             }
-        except Exception as e:
-            raise Exception(f"Failed to initiate phone change: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to initiate phone change") from e
 
     async def verify_phone_change(self, access_token: str, new_phone: str, otp: str) -> Dict[str, Any]:
         """
         Verify the phone change with the OTP sent to the new number.
         """
+        otp_verify_limiter.take(new_phone)
         try:
-            self.client.auth.set_session(access_token, access_token)
-            response = self.client.auth.verify_otp({
+            client = await self._scoped_client()
+            await client.auth.set_session(access_token, access_token)
+            response = await client.auth.verify_otp({
                 "phone": new_phone,
                 "token": otp,
                 "type": "phone_change"
             })
             
             if not response.user:
-                raise Exception("Phone change verification failed")
+                raise AuthServiceError("Failed to verify phone change: Phone change verification failed")
+            
+            # The cached profile still carries the old phone number
+            self._invalidate_user(access_token=access_token, user_id=response.user.id)
                 
             return {
                 "success": True,
                 "message": "Phone number updated successfully",
                 "phone": response.user.phone
             }
-        except Exception as e:
-            raise Exception(f"Failed to verify phone change: {str(e)}")
+        except _SDK_ERRORS as e:
+            raise _service_error(e, "Failed to verify phone change") from e
 
 
 # Singleton instance
@@ -0,0 +1,63 @@
+"""
+Typed errors raised by the authentication service
+A single app-level handler turns them into HTTP responses from status_code
+"""
+
+from typing import Optional
+
+
+class AuthServiceError(Exception):
+    """
+    Base error for authentication failures
+
+    status_code is None when the failure has no specific HTTP meaning:
+    the handler then answers 400 Bad Request.
+    """
+
+    status_code: Optional[int] = None
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class AuthInvalidCredentials(AuthServiceError):
+    """Wrong password, invalid/expired OTP, unknown or revoked token"""
+
+    status_code = 401
+
+
+class AuthRateLimited(AuthServiceError):
+    """Too many requests, from our own limiter or from Supabase"""
+
+    status_code = 429
+
+    def __init__(self, message: str = "Too many requests, please retry later", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AuthUnavailable(AuthServiceError):
+    """Supabase unreachable or failing (network error, 5xx)"""
+
+    status_code = 503
+
+
+class OTPSendError(AuthServiceError):
+    """SMS OTP could not be sent"""
+
+    status_code = 500
+
+
+class OTPVerifyError(AuthServiceError):
+    """OTP rejected or no session created"""
+
+    status_code = 401
+
+
+class TokenRefreshError(AuthServiceError):
+    """Refresh token rejected or no session returned"""
+
+    status_code = 401
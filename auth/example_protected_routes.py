@@ -4,14 +4,15 @@ Example: How to protect routes with authentication
 This file demonstrates how to add authentication to existing routes
 """
 
+from typing import Annotated, Optional
 from fastapi import APIRouter, Depends
-from auth.middleware import require_auth, get_current_user_optional
+from auth.middleware import require_auth, get_current_user_optional, current_user_id
 
 # Example 1: Require authentication for a route
 router = APIRouter()
 
 @router.get("/protected-endpoint")
-async def protected_endpoint(current_user: dict = Depends(require_auth)):
+async def protected_endpoint(current_user: Annotated[dict, Depends(require_auth)]):
     """
     This endpoint requires authentication
     Only users with valid access tokens can access it
@@ -25,7 +26,7 @@ async def protected_endpoint(current_user: dict = Depends(require_auth)):
 
 # Example 2: Optional authentication
 @router.get("/optional-auth-endpoint")
-async def optional_auth_endpoint(current_user: dict = Depends(get_current_user_optional)):
+async def optional_auth_endpoint(current_user: Annotated[Optional[dict], Depends(get_current_user_optional)]):
     """
     This endpoint works with or without authentication
     Provides different responses based on auth status
@@ -50,7 +51,7 @@ async def optional_auth_endpoint(current_user: dict = Depends(get_current_user_o
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
     request: ChatRequest,
-    current_user: dict = Depends(require_auth)  # Add this line
+    current_user: Annotated[dict, Depends(require_auth)]  # Add this line
 ) -> ChatResponse:
     # Now only authenticated users can chat
     # You can use current_user["id"] to personalize responses
@@ -66,12 +67,11 @@ async def chat_endpoint(
 
 # Example 4: Create user-specific endpoints
 @router.get("/my-orders")
-async def get_my_orders(current_user: dict = Depends(require_auth)):
+async def get_my_orders(user_id: Annotated[str, Depends(current_user_id)]):
     """
     Get orders for the authenticated user
+    Only the id is needed, so depend on current_user_id instead of the full user
     """
-    user_id = current_user["id"]
-    
     # Fetch orders from database
     # orders = await db.orders.find({"user_id": user_id})
     
@@ -82,12 +82,10 @@ async def get_my_orders(current_user: dict = Depends(require_auth)):
 
 
 @router.get("/my-cart")
-async def get_my_cart(current_user: dict = Depends(require_auth)):
+async def get_my_cart(user_id: Annotated[str, Depends(current_user_id)]):
     """
     Get cart for the authenticated user
     """
-    user_id = current_user["id"]
-    
     # Fetch cart from database using user_id instead of session_id
     # cart = await cart_service.get_cart(user_id)
     
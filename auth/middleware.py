@@ -2,17 +2,152 @@
 Authentication middleware and dependencies for FastAPI
 """
 
-from fastapi import Depends, HTTPException, status
+import os
+import time
+import hashlib
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
+from typing import Annotated, Optional, Tuple
+from jose import jwt, JWTError, ExpiredSignatureError
 from .auth_service import auth_service
+from .errors import AuthServiceError, AuthUnavailable
 
-# Security scheme for JWT bearer tokens
+# Security schemes for JWT bearer tokens (required / optional), built once
 security = HTTPBearer()
+_security_optional = HTTPBearer(auto_error=False)
+
+# Project JWT secret (Supabase dashboard > API > JWT Secret). When set, access
+# tokens are verified in-process instead of with a GoTrue round-trip.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+
+# Tokens verified locally (HS256) are remembered until their exp (at most an
+# hour), so a client reusing its bearer token skips verification. Tokens GoTrue
+# verified are not kept here: AuthService.get_user already caches them for
+# USER_CACHE_TTL_SECONDS, and one cache means one place to invalidate.
+# CACHE_JWT_VALIDATION=0 turns it off, e.g. to benchmark with and without.
+CACHE_JWT_VALIDATION = os.getenv("CACHE_JWT_VALIDATION", "1").lower() not in ("0", "false", "no")
+_JWT_CACHE_MAX_TTL = 3600
+_validated_tokens: TTLCache = TTLCache(maxsize=10_000, ttl=_JWT_CACHE_MAX_TTL)
+
+def _user_from_claims(payload: dict) -> dict:
+    """Build the same user shape as AuthService._format_user from JWT claims"""
+    metadata = {}
+    for claim in ("user_metadata", "app_metadata"):
+        val = payload.get(claim)
+        if val and isinstance(val, dict):
+            metadata.update(val)
+    
+    display_name = metadata.get("display_name") or metadata.get("full_name") or metadata.get("name")
+    
+    return {
+        "id": payload["sub"],
+        "phone": payload.get("phone"),
+        "display_name": display_name,
+        "user_metadata": metadata,
+        # Not carried by the access token
+        "created_at": None,
+        "last_sign_in_at": None
+    }
+
+
+def _token_key(access_token: str) -> bytes:
+    """Cache key for a token: a hash, so raw JWTs are not kept in memory"""
+    return hashlib.blake2b(access_token.encode(), digest_size=16).digest()
+
+
+def invalidate_cached_token(access_token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    """
+    Forget validated tokens after logout or a profile change
+    
+    Drops the entry for one token, or for every token of a user.
+    """
+    if access_token:
+        _validated_tokens.pop(_token_key(access_token), None)
+    if user_id:
+        for key, (_, user, _) in list(_validated_tokens.items()):
+            if user.get("id") == user_id:
+                _validated_tokens.pop(key, None)
+
+
+async def _resolve_user(access_token: str) -> Tuple[dict, Optional[dict]]:
+    """
+    Verify an access token, reusing a previous validation when possible
+    
+    Only successful local validations are cached; invalid tokens are checked
+    again, and GoTrue results are cached by AuthService.get_user.
+    """
+    if not CACHE_JWT_VALIDATION:
+        return await _verify_token(access_token)
+    
+    key = _token_key(access_token)
+    cached = _validated_tokens.get(key)
+    now = time.time()
+    if cached is not None:
+        expires_at, user, payload = cached
+        if expires_at > now:
+            return dict(user), payload
+        _validated_tokens.pop(key, None)
+    
+    user, payload = await _verify_token(access_token)
+    
+    exp = payload.get("exp") if payload is not None else None
+    if exp and exp > now:
+        _validated_tokens[key] = (min(exp, now + _JWT_CACHE_MAX_TTL), dict(user), payload)
+    return user, payload
+
+
+async def _verify_token(access_token: str) -> Tuple[dict, Optional[dict]]:
+    """
+    Verify an access token and return the user it belongs to
+    
+    HS256 tokens are checked locally against SUPABASE_JWT_SECRET; tokens the
+    secret cannot verify (no secret, asymmetric signing keys) go to GoTrue.
+    
+    Returns:
+        (user, decoded JWT payload or None when GoTrue verified the token)
+    
+    Raises:
+        ExpiredSignatureError: If the token is expired
+        AuthServiceError: If the token is rejected by GoTrue
+    """
+    if SUPABASE_JWT_SECRET:
+        try:
+            payload = jwt.decode(
+                access_token,
+                SUPABASE_JWT_SECRET,
+                algorithms=["HS256"],
+                audience="authenticated",
+                options={"require_exp": True, "require_sub": True},
+            )
+            return _user_from_claims(payload), payload
+        except ExpiredSignatureError:
+            raise
+        except JWTError:
+            pass
+    
+    return await auth_service.get_user(access_token), None
+
+
+async def _request_user(request: Request, access_token: str) -> dict:
+    """
+    Resolve the user once per request
+    
+    The result is kept on request.state.current_user, so the required and
+    optional dependencies (and handlers) share a single verification. A
+    locally decoded token also leaves its claims on request.state.jwt_payload.
+    """
+    user = getattr(request.state, "current_user", None)
+    if user is None:
+        user, payload = await _resolve_user(access_token)
+        request.state.current_user = user
+        request.state.jwt_payload = payload
+    return user
 
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    request: Request,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
 ) -> dict:
     """
     FastAPI dependency to get current authenticated user
@@ -28,18 +163,25 @@ async def get_current_user(
     """
     try:
         access_token = credentials.credentials
-        user = await auth_service.get_user(access_token)
+        user = await _request_user(request, access_token)
         return user
-    except Exception as e:
+    except AuthUnavailable as e:
+        # Supabase is down: the token may well be valid, do not log the client out
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=e.message,
+        )
+    except (AuthServiceError, JWTError) as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid or expired token: {str(e)}",
+            detail=f"Invalid or expired token: {e}",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
 
 async def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+    request: Request,
+    credentials: Annotated[Optional[HTTPAuthorizationCredentials], Depends(_security_optional)]
 ) -> Optional[dict]:
     """
     FastAPI dependency to get current user if authenticated, None otherwise
@@ -49,19 +191,20 @@ async def get_current_user_optional(
         
     Returns:
         User information dictionary or None if not authenticated
+        (also available as request.state.current_user)
     """
     if not credentials:
         return None
     
     try:
         access_token = credentials.credentials
-        user = await auth_service.get_user(access_token)
+        user = await _request_user(request, access_token)
         return user
-    except Exception:
+    except (AuthServiceError, JWTError):
         return None
 
 
-def require_auth(user: dict = Depends(get_current_user)) -> dict:
+def require_auth(user: Annotated[dict, Depends(get_current_user)]) -> dict:
     """
     Dependency to require authentication for a route
     
@@ -72,3 +215,27 @@ def require_auth(user: dict = Depends(get_current_user)) -> dict:
         User information dictionary
     """
     return user
+
+
+async def current_user_id(request: Request, user: Annotated[dict, Depends(get_current_user)]) -> str:
+    """
+    Dependency returning only the authenticated user's id
+    
+    Reads the "sub" claim of the already decoded token when available.
+    """
+    payload = getattr(request.state, "jwt_payload", None)
+    return payload["sub"] if payload else user["id"]
+
+
+async def auth_context(
+    request: Request,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
+) -> Tuple[dict, str]:
+    """
+    Dependency returning (user, raw access token) in one go
+    
+    For routes that forward the user's token to Supabase (logout, phone change):
+    the header is parsed and the token verified once.
+    """
+    user = await get_current_user(request, credentials)
+    return user, credentials.credentials
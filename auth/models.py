@@ -2,96 +2,99 @@
 Pydantic models for authentication requests and responses
 """
 
-from pydantic import BaseModel, Field, validator
-from typing import Optional, Union, Any, Dict
+import re
+from functools import lru_cache
+from pydantic import BaseModel, ConfigDict, Field, BeforeValidator
+from typing import Optional, Union, Any, Dict, Annotated, TypedDict
 from datetime import datetime
 import phonenumbers
 
 
+# Already-normalized E.164 numbers skip phonenumbers entirely
+_E164_RE = re.compile(r"^\+[1-9]\d{7,14}$")
+
+
+@lru_cache(maxsize=8192)
+def _parse_phone(v: str) -> str:
+    """Normalize a phone number to E.164, Benin (BJ) being the default region"""
+    try:
+        parsed = phonenumbers.parse(v, "BJ")
+    except phonenumbers.NumberParseException:
+        raise ValueError("Phone number must be in E.164 format (e.g., +1234567890)")
+    
+    if not phonenumbers.is_possible_number(parsed):
+        raise ValueError("Invalid phone number")
+    
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+
+
+def _validate_e164(v: Any) -> str:
+    """Shared phone validator for every request model"""
+    if not isinstance(v, str):
+        raise ValueError("Phone number must be a string")
+    # Padded variants of a number share the fast path and the cache entry
+    v = v.strip()
+    if _E164_RE.match(v):
+        return v
+    return _parse_phone(v)
+
+
+# Phone field normalized to E.164: one validator shared by every model
+E164Phone = Annotated[str, BeforeValidator(_validate_e164)]
+
+
 class PhoneNumberRequest(BaseModel):
     """Request model for phone number input"""
-    phone: str = Field(..., description="Phone number in E.164 format (e.g., +1234567890)")
-    
-    @validator('phone')
-    def validate_phone(cls, v):
-        """Validate phone number format"""
-        try:
-            # Try parsing as international first
-            parsed = phonenumbers.parse(v, None)
-        except phonenumbers.NumberParseException:
-            try:
-                # If that fails, try parsing as Benin number (default)
-                parsed = phonenumbers.parse(v, "BJ")
-            except phonenumbers.NumberParseException:
-                raise ValueError("Phone number must be in E.164 format (e.g., +1234567890)")
-        
-        if not phonenumbers.is_possible_number(parsed):
-            raise ValueError("Invalid phone number")
-        
-        # Return in E.164 format
-        return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+    phone: E164Phone = Field(..., description="Phone number in E.164 format (e.g., +1234567890)")
 
 
 class SignUpRequest(BaseModel):
     """Request model for creating a new account"""
-    phone: str = Field(..., description="Phone number in E.164 format")
+    phone: E164Phone = Field(..., description="Phone number in E.164 format")
     password: str = Field(..., min_length=8)
     display_name: Optional[str] = Field(None, description="Optional display name")
-    
-    @validator('phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            if not phonenumbers.is_possible_number(parsed):
-                raise ValueError("Invalid phone number")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
 
 
 class LoginRequest(BaseModel):
     """Request model for logging in with phone and password"""
-    phone: str = Field(..., description="Phone number in E.164 format")
+    phone: E164Phone = Field(..., description="Phone number in E.164 format")
     password: str = Field(...)
-    
-    @validator('phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
+
+
+# Response models are built from trusted service dicts: unknown keys are
+# dropped rather than rejected, attribute objects are accepted as well
+_RESPONSE_MODEL_CONFIG = ConfigDict(extra="ignore", from_attributes=True)
 
 
 class SendOTPResponse(BaseModel):
     """Response after sending OTP"""
+    model_config = _RESPONSE_MODEL_CONFIG
+
     message: str = "OTP sent successfully"
     phone: str
 
 
 class VerifyOTPRequest(BaseModel):
     """Request model for OTP verification"""
-    phone: str = Field(..., description="Phone number in E.164 format")
+    phone: E164Phone = Field(..., description="Phone number in E.164 format")
     otp: str = Field(..., description="6-digit OTP code", min_length=6, max_length=6)
     type: str = Field("sms", description="Verification type: 'sms' (login) or 'signup' (confirmation)")
     password: Optional[str] = Field(None, description="Optional: New password to set upon verification (for seamless signup retry)")
-    
-    @validator('phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
 
 
 class VerifyOTPResponse(BaseModel):
     """Response after successful OTP verification"""
+    model_config = _RESPONSE_MODEL_CONFIG
+
     access_token: str
     refresh_token: str
     expires_in: int
+    # Unix timestamp of expiry: clients should refresh ~60s before it
+    expires_at: Optional[int] = None
     token_type: str = "bearer"
     user: dict
+    # verify-otp with a password only: False when the password could not be saved
+    password_updated: Optional[bool] = None
 
 
 class RefreshTokenRequest(BaseModel):
@@ -101,78 +104,73 @@ class RefreshTokenRequest(BaseModel):
 
 class RefreshTokenResponse(BaseModel):
     """Response after token refresh"""
+    model_config = _RESPONSE_MODEL_CONFIG
+
     access_token: str
     refresh_token: str
     expires_in: int
+    # Unix timestamp of expiry: clients should refresh ~60s before it
+    expires_at: Optional[int] = None
     token_type: str = "bearer"
 
 
 class UserResponse(BaseModel):
     """Response model for user profile information"""
+    model_config = _RESPONSE_MODEL_CONFIG
+
     id: str
     phone: str
     display_name: Optional[str] = None
     user_metadata: Optional[Dict[str, Any]] = None
-    created_at: Union[str, datetime]
+    # None when the user comes from locally verified JWT claims
+    created_at: Optional[Union[str, datetime]] = None
     last_sign_in_at: Optional[Union[str, datetime]] = None
 
 
-class PasswordRecoveryRequest(BaseModel):
-    """Request model for initiating password recovery"""
-    phone: str = Field(..., description="Phone number in E.164 format")
-
-    @validator('phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
+# Password recovery takes the same body as /send-otp: one model, one validator
+PasswordRecoveryRequest = PhoneNumberRequest
 
 
 class PasswordResetRequest(BaseModel):
     """Request model for resetting password with OTP"""
-    phone: str = Field(..., description="Phone number in E.164 format")
+    phone: E164Phone = Field(..., description="Phone number in E.164 format")
     otp: str = Field(..., description="6-digit OTP code", min_length=6, max_length=6)
     new_password: str = Field(..., description="New password (min 8 characters)", min_length=8)
 
-    @validator('phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
-
 
 class PhoneChangeRequest(BaseModel):
     """Request model for initiating phone number change"""
-    new_phone: str = Field(..., description="New phone number in E.164 format")
-
-    @validator('new_phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
+    new_phone: E164Phone = Field(..., description="New phone number in E.164 format")
 
 
 class VerifyPhoneChangeRequest(BaseModel):
     """Request model for verifying phone number change"""
-    new_phone: str = Field(..., description="New phone number in E.164 format")
+    new_phone: E164Phone = Field(..., description="New phone number in E.164 format")
     otp: str = Field(..., description="6-digit OTP code", min_length=6, max_length=6)
 
-    @validator('new_phone')
-    def validate_phone(cls, v):
-        try:
-            parsed = phonenumbers.parse(v, "BJ")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Phone number must be in E.164 format")
 
 
 
+class FormattedUser(TypedDict, total=False):
+    """User dict built by AuthService._format_user (empty when there is no user)"""
+    id: str
+    phone: Optional[str]
+    display_name: Optional[str]
+    user_metadata: Dict[str, Any]
+    created_at: Union[str, datetime, None]
+    last_sign_in_at: Union[str, datetime, None]
+
+
+class SessionData(TypedDict, total=False):
+    """Session dict built by AuthService._format_session"""
+    access_token: str
+    refresh_token: str
+    expires_in: int
+    expires_at: Optional[int]
+    token_type: str
+    user: FormattedUser
+    password_updated: bool
+
 
 class ErrorResponse(BaseModel):
     """Error response model"""
@@ -0,0 +1,118 @@
+"""
+In-process rate limiting for OTP endpoints
+Keeps abusive clients from burning SMS credits and tripping Supabase's own 429s
+"""
+
+import os
+import math
+import time
+import orjson
+from cachetools import TTLCache
+from .errors import AuthRateLimited
+
+
+class TokenBucket:
+    """
+    Token bucket per key (e.g. phone number)
+
+    Each key holds up to `burst` tokens and regains one every `refill_seconds`.
+    Idle keys expire from the bounded cache, which is the same as a full bucket.
+    Per-process only: with several workers, each one enforces its own limit.
+    """
+
+    def __init__(self, burst: int, refill_seconds: float, maxsize: int = 100_000):
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        # A bucket left alone for burst * refill_seconds is full again
+        self._buckets: TTLCache = TTLCache(maxsize=maxsize, ttl=burst * refill_seconds)
+
+    def take(self, key: str) -> None:
+        """
+        Consume one token for key
+
+        Raises:
+            AuthRateLimited: If the bucket is empty, with the seconds until the next token
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) / self.refill_seconds)
+
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            raise AuthRateLimited(retry_after=(1 - tokens) * self.refill_seconds)
+
+        self._buckets[key] = (tokens - 1, now)
+
+
+# SMS sends: 3 in a burst, then one per minute
+otp_send_limiter = TokenBucket(burst=3, refill_seconds=60)
+
+# OTP checks: a few typos allowed, then one attempt every 30 seconds
+otp_verify_limiter = TokenBucket(burst=5, refill_seconds=30)
+
+# SMS sends per client IP: generous, since mobile carriers put many users
+# behind one address (CGNAT); the per-phone limit above still applies
+otp_ip_limiter = TokenBucket(burst=20, refill_seconds=10)
+
+# Routes that trigger a paid SMS
+OTP_SEND_PATHS = frozenset({"/auth/send-otp", "/auth/password-recovery/send-otp"})
+
+# Header holding the client IP, set (overwritten) by a trusted edge proxy,
+# e.g. "x-vercel-forwarded-for" on Vercel. Empty: use the socket peer, which
+# uvicorn rewrites from X-Forwarded-For only for FORWARDED_ALLOW_IPS proxies
+CLIENT_IP_HEADER = os.getenv("CLIENT_IP_HEADER", "").strip().lower().encode("latin-1")
+
+
+class OTPRateLimitMiddleware:
+    """
+    Pure ASGI limiter in front of the OTP send routes
+
+    Over the limit, the 429 is sent straight away: no body parsing, no route
+    handler, no Supabase call, so abuse cannot drain the shared pool.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: TokenBucket = otp_ip_limiter,
+        paths: frozenset = OTP_SEND_PATHS,
+        ip_header: bytes = CLIENT_IP_HEADER,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.paths = paths
+        self.ip_header = ip_header
+
+    def _client_ip(self, scope) -> str:
+        # Never the raw X-Forwarded-For: the client controls it and could send
+        # a fresh value per request to dodge the limit
+        if self.ip_header:
+            for name, value in scope["headers"]:
+                if name == self.ip_header:
+                    # Right-most hop: the one appended by the trusted proxy
+                    return value.rsplit(b",", 1)[-1].strip().decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self.limiter.take(self._client_ip(scope))
+        except AuthRateLimited as e:
+            body = orjson.dumps({"error": e.message, "status_code": 429})
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(e.retry_after)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        await self.app(scope, receive, send)
@@ -1,8 +1,15 @@
 """
 FastAPI routes for authentication endpoints
+
+AuthServiceError is not caught here: the app-level handler (app.py) answers
+with the status carried by the error.
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Request
+import logging
+import orjson
+from typing import Annotated, Tuple
+from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.responses import ORJSONResponse, Response
 from .models import (
     PhoneNumberRequest,
     SignUpRequest,
@@ -20,12 +27,19 @@ from .models import (
     VerifyPhoneChangeRequest
 )
 from .auth_service import auth_service
-from .middleware import get_current_user, require_auth, security
+from .errors import AuthServiceError
+from .middleware import require_auth, auth_context, invalidate_cached_token
+
+logger = logging.getLogger(__name__)
+
+# Constant body, encoded once
+_LOGOUT_OK = orjson.dumps({"message": "Logged out successfully"})
 
-# Create router
+# Create router (orjson for every response, even when mounted outside app.py)
 router = APIRouter(
     prefix="/auth",
     tags=["authentication"],
+    default_response_class=ORJSONResponse,
     responses={
         401: {"model": ErrorResponse, "description": "Unauthorized"},
         500: {"model": ErrorResponse, "description": "Internal Server Error"}
@@ -33,24 +47,29 @@ router = APIRouter(
 )
 
 
+async def _send_otp_impl(phone: str, is_recovery: bool) -> dict:
+    """
+    Send an OTP by SMS, for passwordless login or password recovery
+    
+    Supabase uses the same phone OTP for both flows; only the message differs.
+    """
+    result = await auth_service.send_otp(phone)
+    if is_recovery:
+        return {"message": "Recovery OTP sent", "phone": phone}
+    return {"message": result["message"], "phone": result["phone_number"]}
+
+
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
 async def signup(request: SignUpRequest):
     """
     Sign up a new user with phone and password.
     Triggers a one-time SMS verification.
     """
-    try:
-        result = await auth_service.sign_up(
-            request.phone, 
-            request.password, 
-            request.display_name
-        )
-        return result
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
-        )
+    return await auth_service.sign_up(
+        request.phone, 
+        request.password, 
+        request.display_name
+    )
 
 
 @router.post("/login", response_model=VerifyOTPResponse, status_code=status.HTTP_200_OK)
@@ -59,14 +78,9 @@ async def login(request: LoginRequest):
     Login with phone and password.
     No SMS sent.
     """
-    try:
-        result = await auth_service.sign_in_with_password(request.phone, request.password)
-        return VerifyOTPResponse(**result)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e)
-        )
+    result = await auth_service.sign_in_with_password(request.phone, request.password)
+    # SessionData built by our own service: no need to validate it again
+    return VerifyOTPResponse.model_construct(**result)
 
 
 @router.post("/send-otp", response_model=SendOTPResponse, status_code=status.HTTP_200_OK)
@@ -74,17 +88,7 @@ async def send_otp(request: PhoneNumberRequest):
     """
     Send OTP code to phone number (Passwordless flow)
     """
-    try:
-        result = await auth_service.send_otp(request.phone)
-        return SendOTPResponse(
-            message=result["message"],
-            phone=result["phone_number"]
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
-        )
+    return await _send_otp_impl(request.phone, is_recovery=False)
 
 
 @router.post("/verify-otp", response_model=VerifyOTPResponse, status_code=status.HTTP_200_OK)
@@ -95,61 +99,51 @@ async def verify_otp(request: VerifyOTPRequest):
     """
     try:
         result = await auth_service.verify_otp(request.phone, request.otp, request.type, request.password)
-        return VerifyOTPResponse(**result)
-    except Exception as e:
-        print(f"DEBUG: Verification failed for {request.phone} with type {request.type}: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e)
-        )
+    except AuthServiceError as e:
+        logger.debug("Verification failed for %s with type %s: %s", request.phone, request.type, e)
+        raise
+    return VerifyOTPResponse.model_construct(**result)
 
 
 @router.post("/refresh", response_model=RefreshTokenResponse, status_code=status.HTTP_200_OK)
 async def refresh_token(request: RefreshTokenRequest):
     """
     Refresh access token
+    
+    Hot path: the session dict already has the RefreshTokenResponse shape, so it
+    is serialized as is instead of going through the response model.
     """
-    try:
-        result = await auth_service.refresh_session(request.refresh_token)
-        return RefreshTokenResponse(**result)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e)
-        )
+    result = await auth_service.refresh_session(request.refresh_token)
+    return ORJSONResponse(result)
 
 
 @router.post("/logout", status_code=status.HTTP_200_OK)
-async def logout(request: Request, current_user: dict = Depends(require_auth)):
+async def logout(ctx: Annotated[Tuple[dict, str], Depends(auth_context)]):
     """
     Logout user and invalidate session in Supabase
     """
+    _, access_token = ctx
     try:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            access_token = auth_header.split(" ")[1]
-            await auth_service.sign_out(access_token)
+        invalidate_cached_token(access_token=access_token)
+        await auth_service.sign_out(access_token)
             
-        return {"message": "Logged out successfully"}
-    except Exception as e:
+        return Response(content=_LOGOUT_OK, media_type="application/json")
+    except AuthServiceError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to invalidate session on Supabase: {str(e)}"
+            detail=f"Failed to invalidate session on Supabase: {e.message}"
         )
 
 
 @router.get("/me", response_model=UserResponse, status_code=status.HTTP_200_OK)
-async def get_current_user_info(current_user: dict = Depends(require_auth)):
+async def get_current_user_info(current_user: Annotated[dict, Depends(require_auth)]):
     """
     Get current authenticated user information
+    
+    Hot path: the user dict (from AuthService._format_user or the JWT claims)
+    already has the UserResponse shape, so it is serialized as is.
     """
-    try:
-        return UserResponse(**current_user)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
-        )
+    return ORJSONResponse(current_user)
 
 
 @router.post("/password-recovery/send-otp", status_code=status.HTTP_200_OK)
@@ -157,15 +151,7 @@ async def send_recovery_otp(request: PasswordRecoveryRequest):
     """
     Send OTP for password recovery
     """
-    try:
-        # Reusing send_otp since it's the same logic for phone-based recovery in Supabase
-        result = await auth_service.send_otp(request.phone)
-        return {"message": "Recovery OTP sent", "phone": request.phone}
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
-        )
+    return await _send_otp_impl(request.phone, is_recovery=True)
 
 
 @router.post("/password-recovery/reset", status_code=status.HTTP_200_OK)
@@ -173,63 +159,47 @@ async def reset_password(request: PasswordResetRequest):
     """
     Reset password using OTP
     """
-    try:
-        result = await auth_service.reset_password_after_otp(
-            request.phone, 
-            request.otp, 
-            request.new_password
-        )
-        return result
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
-        )
+    result = await auth_service.reset_password_after_otp(
+        request.phone, 
+        request.otp, 
+        request.new_password
+    )
+    invalidate_cached_token(user_id=result["user_id"])
+    return result
 
 
 @router.post("/phone-change/initiate", status_code=status.HTTP_200_OK)
 async def initiate_phone_change_route(
     request: PhoneChangeRequest, 
-    current_user: dict = Depends(require_auth),
-    auth_credentials=Depends(security)
+    ctx: Annotated[Tuple[dict, str], Depends(auth_context)]
 ):
     """
     Initiate phone number change
     """
-    try:
-        result = await auth_service.initiate_phone_change(
-            auth_credentials.credentials, 
-            request.new_phone
-        )
-        return result
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
-        )
+    _, access_token = ctx
+    return await auth_service.initiate_phone_change(
+        access_token, 
+        request.new_phone
+    )
 
 
 @router.post("/phone-change/verify", status_code=status.HTTP_200_OK)
 async def verify_phone_change_route(
     request: VerifyPhoneChangeRequest, 
-    current_user: dict = Depends(require_auth),
-    auth_credentials=Depends(security)
+    ctx: Annotated[Tuple[dict, str], Depends(auth_context)]
 ):
     """
     Verify phone number change
     """
-    try:
-        result = await auth_service.verify_phone_change(
-            auth_credentials.credentials, 
-            request.new_phone, 
-            request.otp
-        )
-        return result
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
-        )
+    current_user, access_token = ctx
+    result = await auth_service.verify_phone_change(
+        access_token, 
+        request.new_phone, 
+        request.otp
+    )
+    # Cached validations still carry the old phone number
+    invalidate_cached_token(access_token=access_token, user_id=current_user["id"])
+    return result
 
 
 
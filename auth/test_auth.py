@@ -1,11 +1,14 @@
 """
 Test script for QualiAPI Authentication
 Tests the password-based flow, passwordless flow, and advanced features (Recovery, Phone Change).
+Also measures p50/p95/p99 latency of the auth endpoints under concurrent load.
 """
 
 import httpx
 import asyncio
 import os
+import time
+import statistics
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,6 +16,10 @@ load_dotenv()
 # API base URL
 BASE_URL = "http://localhost:8000"
 
+# One keep-alive client for every test of a session: connections (and TLS when
+# BASE_URL is remote) are reused from one flow to the next
+_CLIENT = httpx.AsyncClient(base_url=BASE_URL, http2=True, timeout=10.0)
+
 
 async def test_password_auth_flow():
     """Test SignUp + VerifyOTP + Login with Password"""
@@ -25,90 +32,90 @@ async def test_password_auth_flow():
     password = input("Enter password (min 8 chars): ").strip()
     display_name = input("Enter display name (optional, press Enter to skip): ").strip() or None
     
-    async with httpx.AsyncClient() as client:
-        # 1. Sign Up
-        print(f"\n[1/4] Signing up {phone}...")
+    client = _CLIENT
+    # 1. Sign Up
+    print(f"\n[1/4] Signing up {phone}...")
+    try:
+        signup_data = {
+            "phone": phone, 
+            "password": password,
+            "display_name": display_name
+        }
+        response = await client.post(
+            f"{BASE_URL}/auth/signup",
+            json={k: v for k, v in signup_data.items() if v is not None}
+        )
+        response.raise_for_status()
+        result = response.json()
+        print(f"✓ {result['message']}")
+        if "user" in result:
+            user = result["user"]
+            print(f"  User ID: {user['id']}")
+            if "user_metadata" in user:
+                print(f"  Metadata: {user['user_metadata']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Failed to sign up: {e.response.json()}")
+        if "already registered" not in str(e.response.json()):
+            return
+        print("! User already exists, proceeding to login test.")
+        result = {} # Prevent UnboundLocalError
+
+    # 2. Verify OTP (Only required once after signup)
+    if "User created" in (result.get("message") or "") or "Please verify" in (result.get("message") or ""):
+        otp = input("\nEnter the OTP code received by SMS: ").strip()
+        print(f"\n[2/4] Verifying OTP for account activation (and password sync)...")
         try:
-            signup_data = {
+            # We send the password here to ensure it's synced if the user already existed!
+            verify_payload = {
                 "phone": phone, 
-                "password": password,
-                "display_name": display_name
+                "otp": otp,
+                "password": password  # <--- CRITICAL: Send password to rewrite it if user existed
             }
             response = await client.post(
-                f"{BASE_URL}/auth/signup",
-                json={k: v for k, v in signup_data.items() if v is not None}
-            )
-            response.raise_for_status()
-            result = response.json()
-            print(f"✓ {result['message']}")
-            if "user" in result:
-                user = result["user"]
-                print(f"  User ID: {user['id']}")
-                if "user_metadata" in user:
-                    print(f"  Metadata: {user['user_metadata']}")
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Failed to sign up: {e.response.json()}")
-            if "already registered" not in str(e.response.json()):
-                return
-            print("! User already exists, proceeding to login test.")
-            result = {} # Prevent UnboundLocalError
-
-        # 2. Verify OTP (Only required once after signup)
-        if "User created" in (result.get("message") or "") or "Please verify" in (result.get("message") or ""):
-            otp = input("\nEnter the OTP code received by SMS: ").strip()
-            print(f"\n[2/4] Verifying OTP for account activation (and password sync)...")
-            try:
-                # We send the password here to ensure it's synced if the user already existed!
-                verify_payload = {
-                    "phone": phone, 
-                    "otp": otp,
-                    "password": password  # <--- CRITICAL: Send password to rewrite it if user existed
-                }
-                response = await client.post(
-                    f"{BASE_URL}/auth/verify-otp",
-                    json=verify_payload
-                )
-                response.raise_for_status()
-                print(f"✓ Account verified and password synced!")
-            except httpx.HTTPStatusError as e:
-                print(f"✗ Verification failed: {e.response.json()}")
-                return
-
-        # 3. Login with Password (No SMS required)
-        print(f"\n[3/4] Logging in with password '{password}'...")
-        try:
-            response = await client.post(
-                f"{BASE_URL}/auth/login",
-                json={"phone": phone, "password": password}
+                f"{BASE_URL}/auth/verify-otp",
+                json=verify_payload
             )
             response.raise_for_status()
-            result = response.json()
-            access_token = result["access_token"]
-            print(f"✓ Login successful! User ID: {result['user']['id']}")
+            print(f"✓ Account verified and password synced!")
         except httpx.HTTPStatusError as e:
-            print(f"✗ Login failed: {e.response.json()}")
+            print(f"✗ Verification failed: {e.response.json()}")
             return
 
-        # 4. Access Protected Route
-        print(f"\n[4/4] Verifying access with token...")
-        try:
-            response = await client.get(
-                f"{BASE_URL}/auth/me",
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
-            response.raise_for_status()
-            data = response.json()
-            display_name = data.get('display_name')
-            phone = data.get('phone')
-            print(f"✓ Profile retrieved: Hello {display_name if display_name else phone}")
-            if data.get('user_metadata'):
-                print(f"  Full Metadata: {data.get('user_metadata')}")
-            return access_token
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Access denied: {e.response.json()}")
-            return None
+    # 3. Login with Password (No SMS required)
+    print(f"\n[3/4] Logging in with password '{password}'...")
+    try:
+        response = await client.post(
+            f"{BASE_URL}/auth/login",
+            json={"phone": phone, "password": password}
+        )
+        response.raise_for_status()
+        result = response.json()
+        access_token = result["access_token"]
+        print(f"✓ Login successful! User ID: {result['user']['id']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Login failed: {e.response.json()}")
+        return
+
+    # 4. Access Protected Route
+    print(f"\n[4/4] Verifying access with token...")
+    try:
+        response = await client.get(
+            f"{BASE_URL}/auth/me",
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        response.raise_for_status()
+        data = response.json()
+        display_name = data.get('display_name')
+        phone = data.get('phone')
+        print(f"✓ Profile retrieved: Hello {display_name if display_name else phone}")
+        if data.get('user_metadata'):
+            print(f"  Full Metadata: {data.get('user_metadata')}")
+        return access_token
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Access denied: {e.response.json()}")
+        return None
 
-        print("\n✓ PASSWORD AUTH FLOW TEST COMPLETED!")
+    print("\n✓ PASSWORD AUTH FLOW TEST COMPLETED!")
 
 
 async def test_password_recovery():
@@ -119,33 +126,33 @@ async def test_password_recovery():
     
     phone = input("\nEnter phone number (+229...): ").strip()
     
-    async with httpx.AsyncClient() as client:
-        # 1. Send Recovery OTP
-        print(f"\n[1/2] Sending recovery OTP...")
-        try:
-            response = await client.post(
-                f"{BASE_URL}/auth/password-recovery/send-otp",
-                json={"phone": phone}
-            )
-            response.raise_for_status()
-            print(f"✓ {response.json()['message']}")
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Failed: {e.response.json()}")
-            return
+    client = _CLIENT
+    # 1. Send Recovery OTP
+    print(f"\n[1/2] Sending recovery OTP...")
+    try:
+        response = await client.post(
+            f"{BASE_URL}/auth/password-recovery/send-otp",
+            json={"phone": phone}
+        )
+        response.raise_for_status()
+        print(f"✓ {response.json()['message']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Failed: {e.response.json()}")
+        return
 
-        # 2. Reset Password
-        otp = input("\nEnter OTP: ").strip()
-        new_password = input("Enter NEW password: ").strip()
-        print(f"\n[2/2] Resetting password...")
-        try:
-            response = await client.post(
-                f"{BASE_URL}/auth/password-recovery/reset",
-                json={"phone": phone, "otp": otp, "new_password": new_password}
-            )
-            response.raise_for_status()
-            print(f"✓ {response.json()['message']}")
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Failed: {e.response.json()}")
+    # 2. Reset Password
+    otp = input("\nEnter OTP: ").strip()
+    new_password = input("Enter NEW password: ").strip()
+    print(f"\n[2/2] Resetting password...")
+    try:
+        response = await client.post(
+            f"{BASE_URL}/auth/password-recovery/reset",
+            json={"phone": phone, "otp": otp, "new_password": new_password}
+        )
+        response.raise_for_status()
+        print(f"✓ {response.json()['message']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Failed: {e.response.json()}")
 
 
 async def test_account_management():
@@ -159,52 +166,52 @@ async def test_account_management():
         print("Access token required for these tests.")
         return
 
-    async with httpx.AsyncClient() as client:
-        headers = {"Authorization": f"Bearer {access_token}"}
-        
-        # 1. Email Update
-        new_email = input("\nEnter new email (or press Enter to skip): ").strip()
-        if new_email:
-            print(f"\n[1/3] Updating email to {new_email}...")
-            try:
-                response = await client.post(
-                    f"{BASE_URL}/auth/email/update",
-                    headers=headers,
-                    json={"email": new_email}
-                )
-                response.raise_for_status()
-                print(f"✓ {response.json()['message']}")
-            except httpx.HTTPStatusError as e:
-                print(f"✗ Email update failed: {e.response.json()}")
+    client = _CLIENT
+    headers = {"Authorization": f"Bearer {access_token}"}
+    
+    # 1. Email Update
+    new_email = input("\nEnter new email (or press Enter to skip): ").strip()
+    if new_email:
+        print(f"\n[1/3] Updating email to {new_email}...")
+        try:
+            response = await client.post(
+                f"{BASE_URL}/auth/email/update",
+                headers=headers,
+                json={"email": new_email}
+            )
+            response.raise_for_status()
+            print(f"✓ {response.json()['message']}")
+        except httpx.HTTPStatusError as e:
+            print(f"✗ Email update failed: {e.response.json()}")
 
-        # 2. Phone Change Initiate
-        new_phone = input("\nEnter NEW phone number to change to (or Enter to skip): ").strip()
-        if new_phone:
-            print(f"\n[2/3] Initiating phone change to {new_phone}...")
+    # 2. Phone Change Initiate
+    new_phone = input("\nEnter NEW phone number to change to (or Enter to skip): ").strip()
+    if new_phone:
+        print(f"\n[2/3] Initiating phone change to {new_phone}...")
+        try:
+            response = await client.post(
+                f"{BASE_URL}/auth/phone-change/initiate",
+                headers=headers,
+                json={"new_phone": new_phone}
+            )
+            response.raise_for_status()
+            print(f"✓ {response.json()['message']}")
+            
+            # 3. Phone Change Verify
+            otp = input("\nEnter OTP sent to NEW phone: ").strip()
+            print(f"\n[3/3] Verifying phone change...")
             try:
                 response = await client.post(
-                    f"{BASE_URL}/auth/phone-change/initiate",
+                    f"{BASE_URL}/auth/phone-change/verify",
                     headers=headers,
-                    json={"new_phone": new_phone}
+                    json={"new_phone": new_phone, "otp": otp}
                 )
                 response.raise_for_status()
                 print(f"✓ {response.json()['message']}")
-                
-                # 3. Phone Change Verify
-                otp = input("\nEnter OTP sent to NEW phone: ").strip()
-                print(f"\n[3/3] Verifying phone change...")
-                try:
-                    response = await client.post(
-                        f"{BASE_URL}/auth/phone-change/verify",
-                        headers=headers,
-                        json={"new_phone": new_phone, "otp": otp}
-                    )
-                    response.raise_for_status()
-                    print(f"✓ {response.json()['message']}")
-                except httpx.HTTPStatusError as e:
-                    print(f"✗ Phone verification failed: {e.response.json()}")
             except httpx.HTTPStatusError as e:
-                print(f"✗ Phone change initiation failed: {e.response.json()}")
+                print(f"✗ Phone verification failed: {e.response.json()}")
+        except httpx.HTTPStatusError as e:
+            print(f"✗ Phone change initiation failed: {e.response.json()}")
 
 
 async def test_passwordless_flow():
@@ -216,56 +223,195 @@ async def test_passwordless_flow():
     
     phone = input("\nEnter phone number (+229...): ").strip()
     
-    async with httpx.AsyncClient() as client:
-        # 1. Send OTP
-        print(f"\n[1/2] Sending OTP...")
-        try:
-            response = await client.post(
-                f"{BASE_URL}/auth/send-otp",
-                json={"phone": phone}
-            )
-            response.raise_for_status()
-            print(f"✓ {response.json()['message']}")
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Failed: {e.response.json()}")
-            return
+    client = _CLIENT
+    # 1. Send OTP
+    print(f"\n[1/2] Sending OTP...")
+    try:
+        response = await client.post(
+            f"{BASE_URL}/auth/send-otp",
+            json={"phone": phone}
+        )
+        response.raise_for_status()
+        print(f"✓ {response.json()['message']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Failed: {e.response.json()}")
+        return
+        
+    # 2. Verify
+    otp = input("\nEnter OTP: ").strip()
+    print(f"\n[2/2] Verifying...")
+    try:
+        response = await client.post(
+            f"{BASE_URL}/auth/verify-otp",
+            json={"phone": phone, "otp": otp, "type": "sms"}
+        )
+        response.raise_for_status()
+        print(f"✓ Success! User: {response.json()['user']['id']}")
+    except httpx.HTTPStatusError as e:
+        print(f"✗ Verification failed: {e.response.json()}")
+
+
+async def test_load(n_concurrent: int = 100, n_iters: int = 1000):
+    """
+    Concurrent load test: n_concurrent flows sharing n_iters requests
+    
+    Logs in once with LOAD_TEST_PHONE / LOAD_TEST_PASSWORD, then hammers /auth/me
+    (token validation path). Without credentials only /health is loaded.
+    No OTP is sent, so no SMS credits are used.
+    """
+    
+    print("\n" + "=" * 60)
+    print(f"TEST: LOAD ({n_concurrent} concurrent flows, {n_iters} requests)")
+    print("=" * 60)
+    
+    phone = os.getenv("LOAD_TEST_PHONE")
+    password = os.getenv("LOAD_TEST_PASSWORD")
+    
+    limits = httpx.Limits(max_connections=200)
+    async with httpx.AsyncClient(base_url=BASE_URL, http2=True, limits=limits) as client:
+        headers = None
+        path = "/health"
+        if phone and password:
+            try:
+                response = await client.post("/auth/login", json={"phone": phone, "password": password})
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                print(f"✗ Login failed: {e.response.json()}")
+                return
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            path = "/auth/me"
+        else:
+            print("! LOAD_TEST_PHONE / LOAD_TEST_PASSWORD not set: loading /health only")
+        
+        latencies = []
+        errors = 0
+        
+        async def one_flow(i: int):
+            nonlocal errors
+            for _ in range(n_iters // n_concurrent):
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=headers)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append((time.perf_counter() - start) * 1000)
+                if not ok:
+                    errors += 1
+        
+        started = time.perf_counter()
+        await asyncio.gather(*[one_flow(i) for i in range(n_concurrent)])
+        elapsed = time.perf_counter() - started
+    
+    if len(latencies) < 2:
+        print("✗ Not enough requests to compute percentiles")
+        return
+    
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"✓ {len(latencies)} requests on {path} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s), {errors} errors")
+    print(f"  p50: {percentiles[49]:.1f} ms | p95: {percentiles[94]:.1f} ms | p99: {percentiles[98]:.1f} ms")
+
+
+async def test_ip_limit_ignores_spoofed_xff():
+    """
+    In-process check of OTPRateLimitMiddleware (no server, no SMS sent)
+
+    One client sends a fresh spoofed X-Forwarded-For on every request: the
+    bucket must stay keyed on its real address, so the burst still runs out.
+    Run from the repo root: python -m auth.test_auth
+    """
+    from auth.rate_limit import OTPRateLimitMiddleware, TokenBucket
+
+    print("\n" + "=" * 60)
+    print("TEST: OTP IP LIMIT vs SPOOFED X-FORWARDED-FOR")
+    print("=" * 60)
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    burst = 3
+    middleware = OTPRateLimitMiddleware(app, limiter=TokenBucket(burst=burst, refill_seconds=60), ip_header=b"")
+
+    statuses = []
+    for i in range(burst + 2):
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/auth/send-otp",
+            "headers": [(b"x-forwarded-for", f"10.0.0.{i}".encode())],
+            "client": ("203.0.113.7", 50000 + i),
+        }
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope, None, send)
+        statuses.append(sent[0]["status"])
+
+    assert statuses == [200] * burst + [429, 429], statuses
+    print(f"✓ Spoofed X-Forwarded-For ignored: {statuses}")
+
+    # Header from a trusted proxy: the right-most hop (appended by the proxy) is the key
+    middleware = OTPRateLimitMiddleware(app, limiter=TokenBucket(burst=1, refill_seconds=60), ip_header=b"x-vercel-forwarded-for")
+    statuses = []
+    for spoofed in ("1.1.1.1", "2.2.2.2"):
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/auth/send-otp",
+            "headers": [(b"x-vercel-forwarded-for", f"{spoofed}, 198.51.100.9".encode())],
+            "client": ("127.0.0.1", 443),
+        }
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope, None, send)
+        statuses.append(sent[0]["status"])
+
+    assert statuses == [200, 429], statuses
+    print(f"✓ Trusted proxy header keyed on its own hop: {statuses}")
+
+
+async def main():
+    """Interactive menu, run in a single event loop so _CLIENT stays usable"""
+    try:
+        while True:
+            print("\n--- MENU ---")
+            print("1. Test Password Flow (Signup/Login)")
+            print("2. Test Passwordless Flow (OTP only)")
+            print("3. Test Password Recovery (Forgot Password)")
+            print("4. Test Account Management (Phone Change/Email)")
+            print("5. Load Test (p50/p95/p99)")
+            print("6. OTP IP Limit vs Spoofed X-Forwarded-For (offline)")
+            print("q. Quit")
+            choice = input("Choice: ").strip().lower()
             
-        # 2. Verify
-        otp = input("\nEnter OTP: ").strip()
-        print(f"\n[2/2] Verifying...")
-        try:
-            response = await client.post(
-                f"{BASE_URL}/auth/verify-otp",
-                json={"phone": phone, "otp": otp, "type": "sms"}
-            )
-            response.raise_for_status()
-            print(f"✓ Success! User: {response.json()['user']['id']}")
-        except httpx.HTTPStatusError as e:
-            print(f"✗ Verification failed: {e.response.json()}")
+            if choice == "1":
+                await test_password_auth_flow()
+            elif choice == "2":
+                await test_passwordless_flow()
+            elif choice == "3":
+                await test_password_recovery()
+            elif choice == "4":
+                await test_account_management()
+            elif choice == "5":
+                await test_load()
+            elif choice == "6":
+                await test_ip_limit_ignores_spoofed_xff()
+            elif choice == "q":
+                break
+            else:
+                print("Invalid choice")
+    finally:
+        await _CLIENT.aclose()
 
 
 if __name__ == "__main__":
     print("\nQualiAPI Auth Tester - Advanced")
     print("Make sure the API is running (python app.py)")
     
-    while True:
-        print("\n--- MENU ---")
-        print("1. Test Password Flow (Signup/Login)")
-        print("2. Test Passwordless Flow (OTP only)")
-        print("3. Test Password Recovery (Forgot Password)")
-        print("4. Test Account Management (Phone Change/Email)")
-        print("q. Quit")
-        choice = input("Choice: ").strip().lower()
-        
-        if choice == "1":
-            asyncio.run(test_password_auth_flow())
-        elif choice == "2":
-            asyncio.run(test_passwordless_flow())
-        elif choice == "3":
-            asyncio.run(test_password_recovery())
-        elif choice == "4":
-            asyncio.run(test_account_management())
-        elif choice == "q":
-            break
-        else:
-            print("Invalid choice")
+    asyncio.run(main())
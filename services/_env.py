@@ -0,0 +1,17 @@
+"""
+Chargement unique du fichier .env pour tout le processus.
+Chaque module appelle ensure_env() : seul le premier appel lit et parse le fichier.
+"""
+
+from dotenv import load_dotenv
+
+_loaded = False
+
+
+def ensure_env() -> None:
+    """Charge .env dans os.environ (sans écraser les variables déjà définies)"""
+    global _loaded
+    if _loaded:
+        return
+    load_dotenv()
+    _loaded = True
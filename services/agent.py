@@ -4,22 +4,27 @@ Sert de commutateur entre le mode 'Rotation' (local) et 'Direct OpenAI' (product
 """
 
 import os
-from dotenv import load_dotenv
+from ._env import ensure_env
 import logging
 
-load_dotenv()
+ensure_env()
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module : la configuration (niveau, handlers) revient à l'application
 logger = logging.getLogger(__name__)
 
 # Utilisation forcée de l'agent Direct (Mistral) quel que soit l'environnement
 logger.info("✨ Utilisation de l'agent Direct Mistral (agent_direct.py)")
 try:
-    from .agent_direct import agent_executor
+    from .agent_direct import create_qualiwo_agent_direct as get_agent_executor
 except ImportError as e:
     logger.error(f"Erreur d'importation de agent_direct: {e}")
     raise e
 
 # Export des constantes nécessaires au reste de l'application si besoin
 from .prompts import SYSTEM_PROMPT as prompt
+
+def __getattr__(name):
+    """Compatibilité : `agent_executor` reste importable, construit au premier accès"""
+    if name == "agent_executor":
+        return get_agent_executor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,45 +5,90 @@ Utilisée en production pour éviter les timeouts liés aux rotations de clés/f
 
 from langchain_mistralai import ChatMistralAI
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import trim_messages
+from langchain_core.runnables import RunnableLambda
 from .tools import TOOLS
+from .intents import direct_cart_call
+from .checkpointer import BoundedMemorySaver
+from .llm_http import mistral_http_clients
 import os
-from dotenv import load_dotenv
+from functools import lru_cache
+from ._env import ensure_env
 import logging
 
-load_dotenv()
+ensure_env()
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module : la configuration (niveau, handlers) revient à l'application
 logger = logging.getLogger(__name__)
 
-# Initialiser le LLM Mistral directement
-mistral_api_key = os.getenv("MISTRAL_API_KEY")
+from .prompts import SYSTEM_MESSAGE
 
-if not mistral_api_key:
-    logger.error("❌ MISTRAL_API_KEY manquante dans l'environnement")
-    raise RuntimeError("MISTRAL_API_KEY est requise pour le mode Direct Mistral.")
+# Nombre maximum de messages d'historique envoyés au LLM à chaque étape
+MAX_HISTORY_MESSAGES = int(os.getenv("AGENT_MAX_HISTORY_MESSAGES", "30"))
 
-llm = ChatMistralAI(
-    model="mistral-small-latest",
-    api_key=mistral_api_key,
-    temperature=0.7
-)
-
-logger.info("🚀 Agent Direct Mistral configuré (Production)")
-
-from .prompts import SYSTEM_PROMPT
+def trim_history(state):
+    """
+    Borne l'historique transmis au LLM (pre_model_hook).
+    L'état complet reste dans le checkpointer : seuls les derniers messages,
+    en commençant par un message utilisateur, sont envoyés au modèle.
+    """
+    messages = trim_messages(
+        state["messages"],
+        strategy="last",
+        token_counter=len,
+        max_tokens=MAX_HISTORY_MESSAGES,
+        start_on="human"
+    )
+    return {"llm_input_messages": messages}
 
+@lru_cache(maxsize=1)
 def create_qualiwo_agent_direct():
     """
     Crée l'agent React avec Mistral direct
+    Construit au premier appel puis mis en cache : l'import du module ne fait
+    aucun travail SDK (démarrage à froid Vercel)
     """
+    # Initialiser le LLM Mistral directement
+    mistral_api_key = os.getenv("MISTRAL_API_KEY")
+    
+    if not mistral_api_key:
+        logger.error("❌ MISTRAL_API_KEY manquante dans l'environnement")
+        raise RuntimeError("MISTRAL_API_KEY est requise pour le mode Direct Mistral.")
+    
+    # Connexions keep-alive partagées : pas de nouvelle poignée TLS par étape
+    http_client, http_async_client = mistral_http_clients(mistral_api_key, timeout=120)
+    llm = ChatMistralAI(
+        model="mistral-small-latest",
+        api_key=mistral_api_key,
+        temperature=0.7,
+        client=http_client,
+        async_client=http_async_client
+    )
+    
+    llm_with_tools = llm.bind_tools(TOOLS)
+    
+    def select_model(state, runtime):
+        """
+        Modèle de l'étape : "voir mon panier" / "je veux payer" reçoivent leur
+        appel show_cart_tool sans aller-retour LLM, le reste va à Mistral
+        """
+        direct_call = direct_cart_call(state["messages"])
+        if direct_call is not None:
+            return RunnableLambda(lambda _: direct_call)
+        return llm_with_tools
+    
     agent = create_react_agent(
-        model=llm,
+        model=select_model,
         tools=TOOLS,
-        prompt=SYSTEM_PROMPT,
-        checkpointer=MemorySaver()
+        prompt=SYSTEM_MESSAGE,
+        pre_model_hook=trim_history,
+        checkpointer=BoundedMemorySaver()
     )
+    logger.info("🚀 Agent Direct Mistral configuré (Production)")
     return agent
 
-agent_executor = create_qualiwo_agent_direct()
+def __getattr__(name):
+    """Compatibilité : `agent_executor` est construit au premier accès (PEP 562)"""
+    if name == "agent_executor":
+        return create_qualiwo_agent_direct()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,134 +8,293 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_mistralai import ChatMistralAI
 from langgraph.prebuilt import ToolNode
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import BaseMessage, SystemMessage
-from typing import Annotated, Sequence, TypedDict
+from langchain_core.caches import InMemoryCache
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from typing import Annotated, Sequence, TypedDict, Optional
 from langgraph.graph.message import add_messages
 from .tools import TOOLS
+from .prompts import SYSTEM_MESSAGE, PROMPT_CACHE_KEY
+from .checkpointer import BoundedMemorySaver
+from .llm_http import mistral_http_clients, openai_http_clients
+from .circuit_breaker import CircuitBreaker, OPEN
+from .intents import direct_cart_call
 import os
-import random
-from dotenv import load_dotenv
+import asyncio
+import hashlib
+import orjson
+import httpx
+from functools import lru_cache
+from ._env import ensure_env
 import logging
 
-load_dotenv()
+ensure_env()
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module : la configuration (niveau, handlers) revient à l'application
 logger = logging.getLogger(__name__)
 
+# Cache exact des réponses LLM, partagé par toutes les instances de la rotation.
+# La clé couvre tout le prompt (système, historique, résultats d'outils) et les
+# outils liés : un "oui" ou un panier différent ne tombe jamais sur la réponse
+# d'une autre conversation. Les demandes répétées à l'identique (panier,
+# paiement en début de session) évitent l'aller-retour vers le fournisseur.
+# Seuls les modèles de ce module l'utilisent : tant que services/agent.py sert
+# agent_direct, ce cache reste vide en production.
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+_llm_cache = InMemoryCache(maxsize=LLM_CACHE_SIZE)
+
+# Schémas JSON des outils, calculés une fois pour toutes les clés : bind_tools
+# reçoit des dicts déjà au format OpenAI, accepté tel quel par les trois fournisseurs
+_TOOL_SCHEMAS = [convert_to_openai_tool(tool) for tool in TOOLS]
+
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
-def get_rotated_llm_with_tools():
+def _status_code(error: Exception) -> Optional[int]:
+    """Code HTTP d'une erreur fournisseur (httpx, SDK OpenAI, Google), si connu"""
+    response = getattr(error, "response", None)
+    for value in (getattr(error, "status_code", None), getattr(error, "code", None), getattr(response, "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+def _is_provider_failure(error: Exception) -> bool:
+    """Quota (429), erreur serveur (5xx), timeout ou réseau : la clé est à écarter"""
+    if isinstance(error, (httpx.TransportError, TimeoutError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+class CircuitBreakerLLM(Runnable):
     """
-    Initialise des modèles avec rotation de clés et bind les outils.
-    Récupère les clés Mistral, Google et OpenAI depuis l'environnement.
+    Instance LLM (déjà liée aux outils) protégée par un disjoncteur.
+    Ouvert, il échoue immédiatement : le routeur passe à la clé suivante
+    sans re-tenter une clé en quota ou en panne à chaque requête.
+    Propre à la rotation de clés : l'agent Direct Mistral servi par
+    services/agent.py n'a qu'une clé et ne passe pas par ici.
     """
-    
-    # 1. Collecter toutes les clés disponibles
-    mistral_keys = []
-    google_keys = []
-    openai_keys = []
-    
-    # Clés standards
-    if os.getenv("MISTRAL_API_KEY"): mistral_keys.append(os.getenv("MISTRAL_API_KEY"))
-    if os.getenv("GOOGLE_API_KEY"): google_keys.append(os.getenv("GOOGLE_API_KEY"))
-    if os.getenv("GEMINI_API_KEY"): google_keys.append(os.getenv("GEMINI_API_KEY"))
-    if os.getenv("OPENAI_API_KEY"): openai_keys.append(os.getenv("OPENAI_API_KEY"))
-    
-    # Clés indexées
-    for i in range(1, 6):
-        m_key = os.getenv(f"MISTRAL_API_KEY_{i}")
-        g_key = os.getenv(f"GOOGLE_API_KEY_{i}")
-        o_key = os.getenv(f"OPENAI_API_KEY_{i}")
-        if m_key: mistral_keys.append(m_key)
-        if g_key: google_keys.append(g_key)
-        if o_key: openai_keys.append(o_key)
-
-    # Déduplication
-    mistral_keys = list(set(mistral_keys))
-    google_keys = list(set(google_keys))
-    openai_keys = list(set(openai_keys))
 
-    llm_instances = []
+    def __init__(self, runnable: Runnable, name: str, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.runnable = runnable
+        self.breaker = CircuitBreaker(name, failure_threshold=failure_threshold, cooldown=cooldown)
+        self.successes = 0
+        self.failures = 0
 
-    # 2. Créer les instances Mistral (PRIORITAIRE)
-    for key in mistral_keys:
+    @property
+    def success_rate(self) -> float:
+        """Taux de succès lissé : une instance jamais appelée vaut 0.5"""
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def _record_success(self) -> None:
+        self.successes += 1
+        self.breaker.record_success()
+
+    def _record_error(self, error: Exception) -> None:
+        if _is_provider_failure(error):
+            self.failures += 1
+            self.breaker.record_failure()
+            if self.breaker.state == OPEN:
+                logger.warning(f"⚡ {self.breaker.name} écartée pour {self.breaker.cooldown:.0f}s : {error}")
+        else:
+            self.breaker.record_reachable()
+
+    def invoke(self, input, config=None, **kwargs):
+        self.breaker.before_call()
         try:
-            llm = ChatMistralAI(
-                model="mistral-small-latest",
-                api_key=key,
-                temperature=0.7,
-                timeout=60,
-                max_retries=3
-            )
-            llm_instances.append(llm.bind_tools(TOOLS))
+            result = self.runnable.invoke(input, config, **kwargs)
         except Exception as e:
-            logger.warning(f"Impossible d'initialiser Mistral avec une clé : {e}")
+            self._record_error(e)
+            raise
+        self._record_success()
+        return result
 
-    # 3. Créer les instances Gemini (SECONDAIRE)
-    for key in google_keys:
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.breaker.before_call()
         try:
-            llm = ChatGoogleGenerativeAI(
-                model="models/gemini-2.0-flash",
-                google_api_key=key,
-                temperature=0.7,
-                timeout=60,
-                max_retries=3
-            )
-            llm_instances.append(llm.bind_tools(TOOLS))
+            result = await self.runnable.ainvoke(input, config, **kwargs)
         except Exception as e:
-            logger.warning(f"Impossible d'initialiser Gemini avec une clé : {e}")
+            self._record_error(e)
+            raise
+        self._record_success()
+        return result
+
+class SuccessRateRouter(Runnable):
+    """
+    Essaie les instances de la meilleure à la moins bonne selon leur taux de succès.
+    Le tri est stable : à taux égal, l'ordre de priorité (Mistral -> Gemini -> OpenAI)
+    est conservé. Une instance saine reste donc principale sur le worker, ce qui
+    garde le cache de prompt du fournisseur chaud ; une clé qui échoue passe derrière.
+    Inutilisé tant que services/agent.py sert l'agent Direct (une seule instance).
+    """
+
+    def __init__(self, instances):
+        self.instances = list(instances)
+
+    def _ordered(self):
+        return sorted(self.instances, key=lambda llm: llm.success_rate, reverse=True)
+
+    def invoke(self, input, config=None, **kwargs):
+        first_error = None
+        for llm in self._ordered():
+            try:
+                return llm.invoke(input, config, **kwargs)
+            except Exception as e:
+                first_error = first_error or e
+        raise first_error
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        first_error = None
+        for llm in self._ordered():
+            try:
+                return await llm.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                first_error = first_error or e
+        raise first_error
 
-    # 4. Créer les instances OpenAI (BACKUP)
-    for key in openai_keys:
+# Variables d'environnement des clés, dans l'ordre de priorité :
+# Mistral (PRIORITAIRE) -> Gemini (SECONDAIRE) -> OpenAI (BACKUP)
+_API_KEY_VARS = (
+    [("MISTRAL_API_KEY", "mistral")] + [(f"MISTRAL_API_KEY_{i}", "mistral") for i in range(1, 6)]
+    + [("GOOGLE_API_KEY", "google"), ("GEMINI_API_KEY", "google")]
+    + [(f"GOOGLE_API_KEY_{i}", "google") for i in range(1, 6)]
+    + [("OPENAI_API_KEY", "openai")] + [(f"OPENAI_API_KEY_{i}", "openai") for i in range(1, 6)]
+)
+
+def _make_mistral(key: str):
+    # Toutes les clés partagent un même pool de connexions (voir llm_http.py)
+    http_client, http_async_client = mistral_http_clients(key, timeout=60)
+    return ChatMistralAI(
+        model="mistral-small-latest",
+        api_key=key,
+        temperature=0.7,
+        timeout=60,
+        max_retries=3,
+        client=http_client,
+        async_client=http_async_client,
+        cache=_llm_cache
+    )
+
+def _make_gemini(key: str):
+    return ChatGoogleGenerativeAI(
+        model="models/gemini-2.0-flash",
+        google_api_key=key,
+        temperature=0.7,
+        timeout=60,
+        max_retries=3,
+        cache=_llm_cache
+    )
+
+def _make_openai(key: str):
+    http_client, http_async_client = openai_http_clients()
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        api_key=key,
+        temperature=0.7,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        model_kwargs={"prompt_cache_key": PROMPT_CACHE_KEY},
+        cache=_llm_cache
+    )
+
+# fournisseur -> (libellé, constructeur)
+_PROVIDERS = {
+    "mistral": ("Mistral", _make_mistral),
+    "google": ("Gemini", _make_gemini),
+    "openai": ("OpenAI", _make_openai),
+}
+
+def get_rotated_llm_with_tools():
+    """
+    Initialise des modèles avec rotation de clés et bind les outils.
+    Récupère les clés Mistral, Google et OpenAI depuis l'environnement.
+    """
+    
+    # 1. Collecter les clés disponibles, dédupliquées sans perdre l'ordre de priorité
+    keys = list(dict.fromkeys(
+        (provider, key)
+        for var, provider in _API_KEY_VARS
+        if (key := os.getenv(var))
+    ))
+
+    llm_instances = []
+    counts = dict.fromkeys(_PROVIDERS, 0)
+
+    # 2. Créer les instances dans cet ordre
+    for provider, key in keys:
+        label, make_llm = _PROVIDERS[provider]
+        counts[provider] += 1
         try:
-            llm = ChatOpenAI(
-                model="gpt-4o-mini",
-                api_key=key,
-                temperature=0.7
-            )
-            llm_instances.append(llm.bind_tools(TOOLS))
+            llm = make_llm(key)
+            llm_instances.append(CircuitBreakerLLM(llm.bind_tools(_TOOL_SCHEMAS), name=f"{label} #{counts[provider]}"))
         except Exception as e:
-            logger.warning(f"Impossible d'initialiser OpenAI avec une clé : {e}")
+            logger.warning(f"Impossible d'initialiser {label} avec une clé : {e}")
 
     if not llm_instances:
         logger.error("❌ Aucune clé API valide trouvée pour la rotation.")
         return None
 
-    # Le premier LLM est le principal, les autres sont des fallbacks
-    primary_llm = llm_instances[0]
-    fallbacks = llm_instances[1:]
-    
-    if fallbacks:
+    # La meilleure instance est la principale, les autres servent de fallbacks
+    if len(llm_instances) > 1:
         logger.info(f"🚀 Rotation configurée avec {len(llm_instances)} instances (Mistral -> Gemini -> OpenAI)")
-        return primary_llm.with_fallbacks(fallbacks)
+        return SuccessRateRouter(llm_instances)
     else:
         logger.info("🚀 Une seule clé trouvée, utilisation directe.")
-        return primary_llm
+        return llm_instances[0]
 
-llm_with_tools = get_rotated_llm_with_tools()
 
-if llm_with_tools is None:
-    raise RuntimeError("Échec de l'initialisation de l'agent avec rotation.")
+# Appels LLM en cours, par conversation et historique : une requête identique
+# arrivée pendant l'appel (double onglet, retry du client) attend le même résultat.
+# Pas de verrou : vérification et insertion se font sans await, dans une seule boucle
+# Seul agent_node (rotation) s'en sert : l'agent Direct en production n'en profite pas
+_inflight: "dict[str, asyncio.Task]" = {}
 
-from .prompts import SYSTEM_PROMPT
+def _inflight_key(thread_id: str, messages) -> str:
+    # Ni les ids de messages ni ceux d'appels d'outils : ils changent à chaque requête
+    history = [
+        (m.type, m.content, [(c["name"], c["args"]) for c in getattr(m, "tool_calls", None) or ()])
+        for m in messages
+    ]
+    digest = hashlib.sha256(orjson.dumps(history, default=str)).hexdigest()
+    return f"{thread_id}:{digest}"
 
+@lru_cache(maxsize=1)
 def create_qualiwo_agent_rotation():
     """
     Crée l'agent React avec rotation de clés manuellement pour éviter le bug de bind_tools sur Fallbacks
+    Construit (LLM + graphe compilé) au premier appel puis mis en cache
     """
+    llm_with_tools = get_rotated_llm_with_tools()
+    
+    if llm_with_tools is None:
+        raise RuntimeError("Échec de l'initialisation de l'agent avec rotation.")
     
     # Définition du noeud de l'agent
-    def agent_node(state: AgentState):
-        messages = list(state['messages'])
+    # Noeud asynchrone : les sessions concurrentes partagent la boucle asyncio et
+    # le pool httpx async (llm_http.py) au lieu d'occuper chacune un thread.
+    # (L'agent servi, agent_direct, l'est déjà : create_react_agent appelle
+    # le modèle en async sous ainvoke/astream.)
+    async def agent_node(state: AgentState, config: RunnableConfig):
+        messages = state['messages']
         
         # Ajouter le prompt système si c'est le premier message ou s'il n'est pas présent
+        # (nouvelle liste : l'état du graphe n'est pas modifié)
         if not messages or not isinstance(messages[0], SystemMessage):
-            messages.insert(0, SystemMessage(content=SYSTEM_PROMPT))
+            messages = [SYSTEM_MESSAGE, *messages]
+        
+        # Intention évidente : l'appel d'outil est émis sans aller-retour LLM
+        direct_call = direct_cart_call(messages)
+        if direct_call is not None:
+            return {"messages": [direct_call]}
             
-        response = llm_with_tools.invoke(messages)
+        key = _inflight_key(config.get("configurable", {}).get("thread_id", ""), messages)
+        task = _inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(llm_with_tools.ainvoke(messages))
+            _inflight[key] = task
+            task.add_done_callback(lambda _: _inflight.pop(key, None))
+        # shield : un client qui se déconnecte n'annule pas l'appel des autres
+        response = await asyncio.shield(task)
         return {"messages": [response]}
 
     # Définition de la condition de continuation
@@ -165,6 +324,10 @@ def create_qualiwo_agent_rotation():
     
     workflow.add_edge("tools", "agent")
     
-    return workflow.compile(checkpointer=MemorySaver())
+    return workflow.compile(checkpointer=BoundedMemorySaver())
 
-agent_executor = create_qualiwo_agent_rotation()
+def __getattr__(name):
+    """Compatibilité : `agent_executor` est construit au premier accès (PEP 562)"""
+    if name == "agent_executor":
+        return create_qualiwo_agent_rotation()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
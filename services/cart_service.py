@@ -1,18 +1,34 @@
 from typing import List, Dict, Any, Optional
+from pymongo.errors import DuplicateKeyError
 from .database import Database
+from cachetools import TTLCache
+import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Fallback en mémoire si MongoDB n'est pas dispo
-_in_memory_carts: Dict[str, List[Dict[str, Any]]] = {}
+# Fallback en mémoire si MongoDB n'est pas dispo.
+# Borné : un panier inactif depuis 1h est oublié (TTL réarmé à chaque écriture)
+_in_memory_carts: "TTLCache[str, List[Dict[str, Any]]]" = TTLCache(maxsize=10_000, ttl=3600)
+_in_memory_lock = threading.RLock()
+
+# Tentatives d'ajout face à des écritures concurrentes (DuplicateKeyError)
+_ADD_RETRIES = 3
+
+def _merge_or_append(items: List[Dict[str, Any]], item: Dict[str, Any], quantity: int) -> None:
+    """Incrémente la quantité si le produit est déjà dans items, sinon l'ajoute"""
+    match = next((i for i in items if i["id"] == item["id"]), None)
+    if match is not None:
+        match["quantity"] += quantity
+    else:
+        items.append(item)
 
 class CartService:
     @staticmethod
     async def get_cart(user_id: str) -> List[Dict[str, Any]]:
         """Récupère le panier d'un utilisateur par son session_id / user_id"""
-        db = Database.get_db()
+        db = await Database.get_db()
         if db is not None:
             try:
                 cart = await db.carts.find_one({"user_id": user_id})
@@ -21,12 +37,15 @@ class CartService:
             except Exception as e:
                 logger.error(f"Erreur get_cart MongoDB: {e}")
         
-        return _in_memory_carts.get(user_id, [])
+        with _in_memory_lock:
+            return _in_memory_carts.get(user_id, [])
 
     @staticmethod
     async def add_to_cart(user_id: str, product: Dict[str, Any], quantity: int = 1) -> bool:
         """Ajoute un produit au panier"""
-        db = Database.get_db()
+        db = await Database.get_db()
+        # Un seul horodatage (secondes, comme les documents déjà stockés)
+        now = time.time()
         
         # Préparer l'item
         item = {
@@ -35,58 +54,54 @@ class CartService:
             "price": product["price"],
             "image": product.get("image_url") or (product.get("images", {}).get("main") if isinstance(product.get("images"), dict) else None),
             "quantity": quantity,
-            "added_at": time.time()
+            "added_at": now
         }
 
         if db is not None:
             try:
-                # Chercher si le produit est déjà là
-                existing_cart = await db.carts.find_one({"user_id": user_id})
-                if existing_cart:
-                    items = existing_cart.get("items", [])
-                    # Mettre à jour la quantité si existe
-                    found = False
-                    for i in items:
-                        if i["id"] == item["id"]:
-                            i["quantity"] += quantity
-                            found = True
-                            break
-                    
-                    if not found:
-                        items.append(item)
-                    
-                    await db.carts.update_one(
-                        {"user_id": user_id},
-                        {"$set": {"items": items, "updated_at": time.time()}}
-                    )
-                else:
-                    await db.carts.insert_one({
-                        "user_id": user_id,
-                        "items": [item],
-                        "created_at": time.time(),
-                        "updated_at": time.time()
-                    })
-                return True
+                inc = {"$inc": {"items.$.quantity": quantity}, "$set": {"updated_at": now}}
+                push = {
+                    "$push": {"items": item},
+                    "$setOnInsert": {"created_at": now},
+                    "$set": {"updated_at": now}
+                }
+                # Un conflit (DuplicateKeyError) signifie qu'une écriture concurrente
+                # a changé le panier entre les deux requêtes : on recommence, en
+                # gardant l'upsert pour le cas où clear_cart l'a supprimé depuis
+                for _ in range(_ADD_RETRIES):
+                    # Produit déjà présent : incrément atomique de la quantité
+                    result = await db.carts.update_one({"user_id": user_id, "items.id": item["id"]}, inc)
+                    if result.matched_count:
+                        return True
+                    # Sinon ajout de l'item (création du panier au besoin).
+                    # Le filtre $ne évite un doublon si un ajout concurrent vient
+                    # de l'insérer : l'upsert heurte alors l'index unique user_id
+                    try:
+                        await db.carts.update_one(
+                            {"user_id": user_id, "items.id": {"$ne": item["id"]}},
+                            push,
+                            upsert=True
+                        )
+                        return True
+                    except DuplicateKeyError:
+                        continue
+                logger.warning(f"add_to_cart: conflits d'écriture répétés sur le panier {user_id}")
+                return False
             except Exception as e:
                 logger.error(f"Erreur add_to_cart MongoDB: {e}")
 
         # Fallback mémoire
-        if user_id not in _in_memory_carts:
-            _in_memory_carts[user_id] = []
-        
-        items = _in_memory_carts[user_id]
-        for i in items:
-            if i["id"] == item["id"]:
-                i["quantity"] += quantity
-                return True
-        
-        items.append(item)
+        with _in_memory_lock:
+            items = _in_memory_carts.get(user_id, [])
+            _merge_or_append(items, item, quantity)
+            # Réaffectation : réarme le TTL du panier
+            _in_memory_carts[user_id] = items
         return True
 
     @staticmethod
     async def clear_cart(user_id: str) -> bool:
         """Vide le panier"""
-        db = Database.get_db()
+        db = await Database.get_db()
         if db is not None:
             try:
                 await db.carts.delete_one({"user_id": user_id})
@@ -94,8 +109,8 @@ class CartService:
             except Exception as e:
                 logger.error(f"Erreur clear_cart MongoDB: {e}")
         
-        if user_id in _in_memory_carts:
-            _in_memory_carts[user_id] = []
+        with _in_memory_lock:
+            _in_memory_carts.pop(user_id, None)
         return True
 
 cart_service = CartService()
@@ -0,0 +1,53 @@
+"""
+Checkpointer LangGraph borné pour les agents Qualiwo.
+MemorySaver garde chaque conversation indéfiniment : sur un processus long,
+la mémoire grossit sans limite. Ici seules les conversations les plus récentes
+sont conservées.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from langgraph.checkpoint.memory import MemorySaver
+
+# Nombre de conversations (thread_id) gardées en mémoire par processus
+AGENT_MAX_THREADS = int(os.getenv("AGENT_MAX_THREADS", "512"))
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver limité aux `max_threads` conversations écrites le plus récemment.
+    Au-delà, la moins récente est supprimée (checkpoints, writes et blobs) :
+    l'utilisateur repart d'une conversation vide, comme après un redémarrage.
+
+    Sérialisation laissée au JsonPlusSerializer par défaut : msgpack (ormsgpack,
+    en Rust) qui reconstruit les messages LangChain typés, sans pickle.
+    """
+
+    def __init__(self, max_threads: int = AGENT_MAX_THREADS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, thread_id: str) -> None:
+        """Marque la conversation comme récente et évince les plus anciennes"""
+        with self._lock:
+            self._recent[thread_id] = None
+            self._recent.move_to_end(thread_id)
+            evicted = []
+            while len(self._recent) > self.max_threads:
+                evicted.append(self._recent.popitem(last=False)[0])
+        for old_thread_id in evicted:
+            super().delete_thread(old_thread_id)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        # aput délègue à put : les deux chemins passent ici
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config["configurable"]["thread_id"])
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._recent.pop(thread_id, None)
+        super().delete_thread(thread_id)
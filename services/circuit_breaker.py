@@ -0,0 +1,77 @@
+"""
+Disjoncteur (circuit breaker) en mémoire pour les appels externes.
+Après plusieurs échecs consécutifs, l'appel échoue immédiatement pendant un
+délai de refroidissement au lieu d'attendre un timeout de plus.
+"""
+
+import time
+import threading
+from typing import Optional
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitOpenError(RuntimeError):
+    """Le disjoncteur est ouvert : l'appel n'a pas été tenté"""
+
+
+class CircuitBreaker:
+    """
+    CLOSED -> OPEN après `failure_threshold` échecs consécutifs.
+    OPEN -> HALF_OPEN une fois `cooldown` secondes écoulées : un seul appel
+    de test passe, les autres échouent vite. Succès -> CLOSED, échec -> OPEN.
+    Sans réponse de l'appel de test après un nouveau `cooldown`, un autre est tenté.
+    Par processus : chaque worker a ses propres disjoncteurs.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.fail_count = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        À appeler avant chaque tentative
+
+        Raises:
+            CircuitOpenError: Si l'appel ne doit pas être tenté
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            # HALF_OPEN expiré aussi : un appel de test annulé en cours de route
+            # (client déconnecté) ne bloque pas le disjoncteur indéfiniment
+            if now - self.opened_at >= self.cooldown:
+                # Cet appelant devient l'unique appel de test
+                self.state = HALF_OPEN
+                self.opened_at = now
+                return
+            raise CircuitOpenError(f"{self.name} : disjoncteur {self.state}")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.fail_count = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.fail_count += 1
+            if self.state == HALF_OPEN or self.fail_count >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_reachable(self) -> None:
+        """Erreur qui prouve que le service répond (ex. 400) : l'appel de test est concluant"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.fail_count = 0
+                self.opened_at = None
@@ -1,45 +1,115 @@
 import os
+import asyncio
+from ._env import ensure_env
+
+# Avant l'import de motor : MOTOR_MAX_WORKERS (taille de son pool de threads)
+# n'est lu qu'une fois, au premier import
+ensure_env()
+
 from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
 import logging
 
-load_dotenv()
-
 logger = logging.getLogger(__name__)
 
+# Pool de connexions MongoDB, par processus (à dimensionner sur les appels
+# concurrents de l'agent : panier, utilisateur)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Attente max d'une connexion libre quand le pool est plein
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+
 class Database:
+    """
+    Client MongoDB unique par processus (état de classe, pas d'instance).
+    La connexion est ouverte au démarrage (lifespan) ou, à défaut, au premier
+    get_db() ; le verrou garantit qu'un seul AsyncIOMotorClient est créé.
+    """
     client: AsyncIOMotorClient = None
     db = None
+    _init_lock = asyncio.Lock()
+    _initialized = False
 
     @classmethod
     async def connect_db(cls):
-        """Initialise la connexion à MongoDB"""
+        """Initialise la connexion à MongoDB (une seule tentative par processus)"""
+        async with cls._init_lock:
+            if cls._initialized:
+                return
+            try:
+                await cls._connect()
+            finally:
+                # Même en échec : pas de nouvelle tentative (et de timeout) à chaque requête
+                cls._initialized = True
+
+    @classmethod
+    async def _connect(cls):
         mongo_uri = os.getenv("MONGODB_URI")
         if not mongo_uri:
             logger.warning("⚠️ MONGODB_URI non trouvée dans .env. Utilisation de la mémoire temporaire.")
             return
 
         try:
-            cls.client = AsyncIOMotorClient(mongo_uri)
+            # Un seul pool par processus, gardé chaud entre les requêtes
+            cls.client = AsyncIOMotorClient(
+                mongo_uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+            )
             cls.db = cls.client.get_database("Qualiwo")
             # Vérifier la connexion
             await cls.client.admin.command('ping')
             logger.info("✅ Connecté à MongoDB")
+            await cls.ensure_indexes()
         except Exception as e:
             logger.error(f"❌ Erreur de connexion à MongoDB : {e}")
+            if cls.client:
+                # Arrête les threads de monitoring du client abandonné
+                cls.client.close()
             cls.client = None
             cls.db = None
 
+    @classmethod
+    async def ensure_indexes(cls):
+        """
+        Index unique sur user_id (idempotent) : un seul document par utilisateur,
+        find/upsert par index au lieu d'un parcours complet de la collection
+        """
+        # carts : mises à jour atomiques du panier ; user : save_user_fields / get_user
+        for collection in ("carts", "user"):
+            try:
+                await cls.db[collection].create_index("user_id", unique=True)
+            except Exception as e:
+                logger.warning(f"⚠️ Index {collection}.user_id non créé : {e}")
+
     @classmethod
     async def close_db(cls):
         """Ferme la connexion à MongoDB"""
         if cls.client:
             cls.client.close()
             logger.info("🔒 Connexion MongoDB fermée")
+        cls.client = None
+        cls.db = None
+        cls._initialized = False
 
     @classmethod
-    def get_db(cls):
+    async def get_db(cls):
+        """Base Qualiwo, ou None si MongoDB est indisponible (connexion au premier appel)"""
+        if not cls._initialized:
+            await cls.connect_db()
         return cls.db
 
-# Instance globale pour le service
-db = Database()
+    @classmethod
+    def _reset_after_fork(cls):
+        # Un MongoClient ne survit pas à un fork : le worker enfant ouvre le sien
+        cls.client = None
+        cls.db = None
+        cls._initialized = False
+        cls._init_lock = asyncio.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Database._reset_after_fork)
@@ -0,0 +1,49 @@
+"""
+Intentions du panier reconnues sans appel LLM.
+Partagé par les deux agents : l'appel show_cart_tool est émis directement,
+la réponse finale après l'outil reste rédigée par le LLM.
+"""
+
+import re
+import uuid
+from typing import Optional
+from langchain_core.messages import AIMessage, HumanMessage
+
+# Intentions sans ambiguïté reconnues sans appel LLM : le message entier doit
+# correspondre, une demande composée ("voir mon panier et ajouter...") passe au LLM
+_CART_WORDS = r"(?:cart|basket|panier)"
+_DIRECT_INTENTS = (
+    (re.compile(
+        rf"^\s*(?:(?:show|see|view|check|open)(?:\s+me)?|voir|affiche[rz]?|montre[rz]?(?:[\s-]+moi)?|ouvre[rz]?)"
+        rf"\s+(?:my|the|mon|le)\s+{_CART_WORDS}\s*[.!?]*\s*$",
+        re.IGNORECASE,
+    ), "view"),
+    (re.compile(
+        rf"^\s*(?:what'?s in my {_CART_WORDS}|qu'?est[\s-]ce qu'?il y a dans mon {_CART_WORDS})\s*[.!?]*\s*$",
+        re.IGNORECASE,
+    ), "view"),
+    (re.compile(
+        r"^\s*(?:i want to |i'?d like to |je veux |je voudrais )?(?:checkout|check out|payer|passer (?:à|a) la caisse)\s*[.!?]*\s*$",
+        re.IGNORECASE,
+    ), "checkout"),
+)
+
+def direct_cart_call(messages) -> Optional[AIMessage]:
+    """
+    Appel show_cart_tool émis directement pour "voir mon panier" / "je veux payer".
+    Uniquement en début de tour (dernier message = utilisateur) : la réponse
+    finale, après exécution de l'outil, reste rédigée par le LLM.
+    """
+    if not messages or not isinstance(messages[-1], HumanMessage):
+        return None
+    text = messages[-1].content
+    if not isinstance(text, str):
+        return None
+    for pattern, action in _DIRECT_INTENTS:
+        if pattern.match(text):
+            return AIMessage(content="", tool_calls=[{
+                "name": "show_cart_tool",
+                "args": {"action": action},
+                "id": f"call_{uuid.uuid4().hex}",
+            }])
+    return None
@@ -0,0 +1,87 @@
+"""
+Pools HTTP partagés par les clients LLM.
+Chaque étape de la boucle React réutilise une connexion TLS déjà ouverte
+au lieu de refaire la poignée de main TCP + TLS vers le fournisseur.
+"""
+
+import os
+import asyncio
+from functools import lru_cache
+from typing import Tuple
+import httpx
+
+# Connexions gardées ouvertes entre deux appels LLM
+LLM_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=20,
+    max_connections=100,
+    keepalive_expiry=30.0
+)
+
+
+@lru_cache(maxsize=1)
+def _sync_transport() -> httpx.HTTPTransport:
+    """Pool synchrone commun (créé au premier besoin)"""
+    return httpx.HTTPTransport(http2=True, limits=LLM_HTTP_LIMITS)
+
+
+@lru_cache(maxsize=1)
+def _async_transport() -> httpx.AsyncHTTPTransport:
+    """Pool asynchrone commun (créé au premier besoin)"""
+    return httpx.AsyncHTTPTransport(http2=True, limits=LLM_HTTP_LIMITS)
+
+
+def _mistral_base_url() -> str:
+    return os.getenv("MISTRAL_BASE_URL") or "https://api.mistral.ai/v1"
+
+
+def mistral_http_clients(api_key: str, timeout: float) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Clients httpx pour ChatMistralAI (client= / async_client=)
+
+    Mêmes base_url et en-têtes que ceux construits par langchain_mistralai,
+    mais chaque clé (rotation) passe par le même pool de connexions.
+    """
+    base_url = _mistral_base_url()
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+    return (
+        httpx.Client(base_url=base_url, headers=headers, timeout=timeout, transport=_sync_transport()),
+        httpx.AsyncClient(base_url=base_url, headers=headers, timeout=timeout, transport=_async_transport()),
+    )
+
+
+@lru_cache(maxsize=1)
+def openai_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Clients httpx pour ChatOpenAI (http_client= / http_async_client=)
+
+    Le SDK OpenAI ajoute lui-même base_url et clé à chaque requête :
+    une seule paire de clients suffit pour toutes les clés.
+    """
+    return (
+        httpx.Client(timeout=60.0, transport=_sync_transport()),
+        httpx.AsyncClient(timeout=60.0, transport=_async_transport()),
+    )
+
+
+async def warm_up_connections() -> None:
+    """
+    Ouvre à l'avance les connexions TLS vers les fournisseurs configurés
+    (requêtes HEAD sur le pool partagé) : le premier tour de chat après un
+    démarrage à froid n'a plus de poignée de main à payer.
+    Les erreurs sont ignorées : ce n'est qu'une optimisation.
+    """
+    urls = []
+    if os.getenv("MISTRAL_API_KEY"):
+        urls.append(_mistral_base_url())
+    if os.getenv("OPENAI_API_KEY"):
+        urls.append("https://api.openai.com/v1")
+    if not urls:
+        return
+    
+    # Pas de `async with` : fermer ce client fermerait aussi le pool partagé
+    client = httpx.AsyncClient(transport=_async_transport(), timeout=5.0)
+    await asyncio.gather(*(client.head(url) for url in urls), return_exceptions=True)
@@ -0,0 +1,161 @@
+"""
+Test script for CartService.add_to_cart under concurrent writes
+Runs offline against an in-memory stand-in for the carts collection (no MongoDB).
+Run from the repo root: python -m services.test_cart_service
+"""
+
+import asyncio
+from types import SimpleNamespace
+from pymongo.errors import DuplicateKeyError
+
+from services import cart_service as cart_module
+from services.cart_service import CartService
+
+
+class FakeCarts:
+    """Just enough of a motor collection for add_to_cart's update_one calls"""
+
+    def __init__(self):
+        self.docs = {}
+        # Called once, between an upsert's match and its insert: a concurrent
+        # write creates the cart there, the insert then hits the unique index
+        self.before_upsert = None
+        # Called once, at the start of the next update_one: e.g. a clear_cart
+        self.before_next_call = None
+
+    def _match(self, query):
+        doc = self.docs.get(query["user_id"])
+        if doc is None:
+            return None
+        ids = [i["id"] for i in doc["items"]]
+        wanted = query.get("items.id")
+        if isinstance(wanted, dict):
+            return doc if wanted["$ne"] not in ids else None
+        if wanted is not None:
+            return doc if wanted in ids else None
+        return doc
+
+    async def update_one(self, query, update, upsert=False):
+        if self.before_next_call is not None:
+            hook, self.before_next_call = self.before_next_call, None
+            await hook()
+        doc = self._match(query)
+        if doc is None:
+            if upsert and self.before_upsert is not None:
+                hook, self.before_upsert = self.before_upsert, None
+                await hook()
+            if not upsert:
+                return SimpleNamespace(matched_count=0)
+            if query["user_id"] in self.docs:
+                raise DuplicateKeyError("E11000 duplicate key error: user_id")
+            doc = self.docs[query["user_id"]] = {"user_id": query["user_id"], "items": []}
+            doc.update(update.get("$setOnInsert", {}))
+        if "$inc" in update:
+            item = next(i for i in doc["items"] if i["id"] == query["items.id"])
+            item["quantity"] += update["$inc"]["items.$.quantity"]
+        if "$push" in update:
+            doc["items"].append(dict(update["$push"]["items"]))
+        doc.update(update.get("$set", {}))
+        return SimpleNamespace(matched_count=1)
+
+
+def _product(product_id):
+    return {"id": product_id, "name": product_id, "price": 1000}
+
+
+async def _run(carts):
+    async def get_db():
+        return SimpleNamespace(carts=carts)
+
+    original = cart_module.Database.get_db
+    cart_module.Database.get_db = get_db
+    try:
+        return await CartService.add_to_cart("u1", _product("p1"), 2)
+    finally:
+        cart_module.Database.get_db = original
+
+
+async def test_add_after_concurrent_cart_creation():
+    """A concurrent add of another product creates the cart first: p1 must still be added"""
+    print("\n" + "=" * 60)
+    print("TEST: ADD_TO_CART vs CONCURRENT CART CREATION")
+    print("=" * 60)
+
+    carts = FakeCarts()
+
+    async def concurrent_add():
+        carts.docs["u1"] = {"user_id": "u1", "items": [{"id": "p2", "quantity": 1}]}
+
+    carts.before_upsert = concurrent_add
+    assert await _run(carts) is True
+    items = {i["id"]: i["quantity"] for i in carts.docs["u1"]["items"]}
+    assert items == {"p2": 1, "p1": 2}, items
+    print(f"✓ Item pushed into the cart created concurrently: {items}")
+
+
+async def test_add_after_concurrent_same_product():
+    """A concurrent add of the same product wins the insert: quantities must add up"""
+    print("\n" + "=" * 60)
+    print("TEST: ADD_TO_CART vs CONCURRENT ADD OF THE SAME PRODUCT")
+    print("=" * 60)
+
+    carts = FakeCarts()
+
+    async def concurrent_add():
+        carts.docs["u1"] = {"user_id": "u1", "items": [{"id": "p1", "quantity": 1}]}
+
+    carts.before_upsert = concurrent_add
+    assert await _run(carts) is True
+    items = {i["id"]: i["quantity"] for i in carts.docs["u1"]["items"]}
+    assert items == {"p1": 3}, items
+    print(f"✓ Quantity incremented on the concurrent item: {items}")
+
+
+async def test_add_when_cart_vanishes():
+    """The conflicting cart is cleared again before the retry: the add must still land"""
+    print("\n" + "=" * 60)
+    print("TEST: ADD_TO_CART vs CART CLEARED DURING THE RETRY")
+    print("=" * 60)
+
+    carts = FakeCarts()
+
+    async def concurrent_add_then_clear():
+        carts.docs["u1"] = {"user_id": "u1", "items": [{"id": "p1", "quantity": 1}]}
+
+        async def clear_cart(*args, **kwargs):
+            carts.docs.pop("u1", None)
+
+        carts.before_next_call = clear_cart
+
+    carts.before_upsert = concurrent_add_then_clear
+    assert await _run(carts) is True
+    items = {i["id"]: i["quantity"] for i in carts.docs["u1"]["items"]}
+    assert items == {"p1": 2}, items
+    print(f"✓ Cart recreated by the retried upsert: {items}")
+
+
+async def test_add_gives_up_after_repeated_conflicts():
+    """Every upsert conflicts and nothing matches: add_to_cart reports the failure"""
+    print("\n" + "=" * 60)
+    print("TEST: ADD_TO_CART vs REPEATED WRITE CONFLICTS")
+    print("=" * 60)
+
+    class ConflictingCarts(FakeCarts):
+        async def update_one(self, query, update, upsert=False):
+            if upsert:
+                raise DuplicateKeyError("E11000 duplicate key error: user_id")
+            return SimpleNamespace(matched_count=0)
+
+    assert await _run(ConflictingCarts()) is False
+    print("✓ add_to_cart returned False instead of claiming success")
+
+
+async def main():
+    await test_add_after_concurrent_cart_creation()
+    await test_add_after_concurrent_same_product()
+    await test_add_when_cart_vanishes()
+    await test_add_gives_up_after_repeated_conflicts()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
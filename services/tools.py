@@ -3,26 +3,119 @@
 Each tool represents a specific action the agent can perform to assist users
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from langchain_core.tools import tool
 import httpx
+import orjson
 import os
+import re
+import copy
+import asyncio
 import time
-from dotenv import load_dotenv
+from cachetools import TTLCache
+from ._env import ensure_env
 from .cart_service import cart_service
 from .user_service import user_service
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
 from langchain_core.runnables import RunnableConfig
 
-load_dotenv()
+ensure_env()
 
 # External API Configuration
 QUALIWO_SEARCH_API_URL = "https://apiquali.vercel.app"
 # "https://search-liart-three.vercel.app"
 #
 
+# Client HTTP partagé vers l'API de recherche (HTTP/2, connexions réutilisées),
+# créé au premier appel et fermé à l'arrêt de l'application
+_search_client: Optional[httpx.AsyncClient] = None
+
+# Après 3 échecs consécutifs (réseau, timeout, 429/5xx), la recherche échoue
+# immédiatement pendant 15 s au lieu d'attendre le timeout à chaque appel
+_search_breaker = CircuitBreaker("Qualiwo Search API", failure_threshold=3, cooldown=15.0)
+
+
+def _get_search_client() -> httpx.AsyncClient:
+    global _search_client
+    if _search_client is None:
+        # Limites et HTTP/2 sur le transport : httpx ignore ceux du client
+        # dès qu'un transport lui est fourni.
+        # retries : nouvelles tentatives de connexion (coupure réseau brève)
+        _search_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            ),
+            timeout=10.0
+        )
+    return _search_client
+
+
+async def close_search_client() -> None:
+    """Ferme le client de l'API de recherche (arrêt de l'application)"""
+    global _search_client
+    if _search_client is not None:
+        await _search_client.aclose()
+        _search_client = None
+
+# Résultats de recherche récents, par (requête normalisée, limite) : le LLM
+# reformule souvent les mêmes catégories. Les recherches sans résultat sont
+# gardées moins longtemps (le catalogue peut être complété entre-temps).
+# Les erreurs de l'API ne sont jamais mises en cache.
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+_search_cache: TTLCache = TTLCache(maxsize=512, ttl=SEARCH_CACHE_TTL_SECONDS)
+_empty_search_cache: TTLCache = TTLCache(maxsize=512, ttl=min(60, SEARCH_CACHE_TTL_SECONDS))
+
+def _user_id(config: RunnableConfig) -> str:
+    """Identifiant du panier / client : le thread_id de la conversation"""
+    configurable = config.get("configurable")
+    return configurable.get("thread_id", "default") if configurable else "default"
+
+
+# Validation des infos client, avant toute écriture MongoDB
+_PHONE_RE = re.compile(r"^\+?[0-9\s\-]{8,15}$")
+
+
+def _check_user_field(field: str, value: str) -> Tuple[Optional[str], Optional[str]]:
+    """Retourne (valeur nettoyée, None) ou (None, message d'erreur)"""
+    value = value.strip()
+    if field == "first_name":
+        if len(value) < 2:
+            return None, "First name too short"
+        if not any(c.isalpha() for c in value):
+            return None, "Invalid first name"
+    if field == "phone" and not _PHONE_RE.match(value):
+        return None, "Invalid phone number"
+    return value, None
+
+
+# Catégories du catalogue (voir SYSTEM_PROMPT) : variantes françaises/anglaises,
+# avec ou sans accents, vers le terme de recherche utilisé par le prompt
+_QUERY_CANON = {
+    "vetements": "clothes",
+    "vêtements": "clothes",
+    "vetement": "clothes",
+    "vêtement": "clothes",
+    "clothing": "clothes",
+    "decoration": "home decoration",
+    "décoration": "home decoration",
+    "deco": "home decoration",
+    "déco": "home decoration",
+    "home decor": "home decoration",
+    "ustensiles de cuisine": "kitchen utensils",
+    "ustensils de cuisine": "kitchen utensils",
+    "ustensiles": "kitchen utensils",
+    "kitchen items": "kitchen utensils",
+}
+
+
+# Immutable defaults for product fields the search API may omit
+_PRODUCT_DEFAULTS = {"brand": None, "short_description": None, "sku": None}
+
 
 @tool
-def product_search_tool(query: str, limit: int = 10) -> Dict[str, Any]:
+async def product_search_tool(query: str, limit: int = 10) -> Dict[str, Any]:
     """
     Search for products in the catalog based on user query.
     
@@ -126,6 +219,23 @@ def product_search_tool(query: str, limit: int = 10) -> Dict[str, Any]:
         "productsSummary": "Error during search: Status 500"
     }
     """
+    # Synonymes connus ramenés à un terme canonique : même requête API, même entrée de cache
+    query = _QUERY_CANON.get(query.strip().lower(), query)
+    cache_key = (query.strip().lower(), limit)
+    cached = _search_cache.get(cache_key) or _empty_search_cache.get(cache_key)
+    if cached is not None:
+        # Copie : l'appelant peut modifier le résultat sans altérer le cache
+        return copy.deepcopy(cached)
+
+    try:
+        _search_breaker.before_call()
+    except CircuitOpenError:
+        return {
+            "items": [],
+            "totalFound": 0,
+            "productsSummary": "Error during search: search API temporarily unavailable"
+        }
+
     try:
         url = f"{QUALIWO_SEARCH_API_URL}/search"
         payload = {
@@ -133,71 +243,68 @@ def product_search_tool(query: str, limit: int = 10) -> Dict[str, Any]:
             "limit": limit
         }
 
-        response = httpx.post(url, json=payload, timeout=10.0)
+        # Non bloquant : les autres conversations continuent pendant l'appel
+        response = await _get_search_client().post(
+            url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
 
         if response.status_code != 200:
+            if response.status_code == 429 or response.status_code >= 500:
+                _search_breaker.record_failure()
+            else:
+                _search_breaker.record_reachable()
             return {
                 "items": [],
                 "totalFound": 0,
                 "productsSummary": f"Error during search: Status {response.status_code}"
             }
 
-        data = response.json()
+        _search_breaker.record_success()
+        data = orjson.loads(response.content)
         results = data.get("results", [])
         total_found = data.get("count", len(results))
 
-        # Normalize products for frontend consistency
-        normalized_products = []
+        # Normalize products for frontend consistency, in place: the parsed
+        # payload is not used elsewhere, so no per-product copy is needed
         for p in results:
-            normalized_p = p.copy()
-            
-            # Ensure product type
-            normalized_p["type"] = "product"
-            
-            # Structure metadata
-            if "meta" not in normalized_p or normalized_p["meta"] is None:
-                normalized_p["meta"] = {}
-            
-            if "source" in normalized_p:
-                normalized_p["meta"]["source"] = normalized_p.get("source") or "Qualiwo"
-            
-            # Set defaults for missing fields
-            defaults = {
-                "brand": None,
-                "short_description": None,
-                "tags": [],
-                "keywords": [],
-                "sku": None
-            }
-            for key, value in defaults.items():
-                if key not in normalized_p:
-                    normalized_p[key] = value
-            
-            normalized_products.append(normalized_p)
+            p["type"] = "product"
+            meta = p.get("meta") or {}
+            meta["source"] = p.get("source") or meta.get("source") or "Qualiwo"
+            p["meta"] = meta
+            for key, value in _PRODUCT_DEFAULTS.items():
+                p.setdefault(key, value)
+            # Fresh lists so products never share a default list
+            p["tags"] = p.get("tags") or []
+            p["keywords"] = p.get("keywords") or []
+        normalized_products = results
 
         # Generate AI-readable summary
         if not normalized_products:
             productsSummary = f'No products found for "{query}".'
         else:
-            summary_lines = []
-            for i, p in enumerate(normalized_products[:5]):  # Top 5 for summary
-                brand = p.get("brand") or p.get("meta", {}).get("source") or "Unknown Brand"
-                price_info = p.get("price", {})
-                price = price_info.get("amount", "N/A")
-                currency = price_info.get("currency", "EUR")
-                categories = ", ".join(p.get("categories", ["N/A"]))
-                summary_lines.append(
-                    f'{i + 1}. "{p.get("name")}" - {brand} - {price} {currency} - Categories: {categories}'
-                )
-            productsSummary = f'Found {total_found} products for "{query}":\n' + "\n".join(summary_lines)
+            # One generator over the top 5 products; meta.source is always set by the normalization
+            summary_lines = "\n".join(
+                f'{i}. "{p.get("name")}" - {p.get("brand") or p["meta"]["source"]}'
+                f' - {(price := p.get("price") or {}).get("amount", "N/A")} {price.get("currency", "EUR")}'
+                f' - Categories: {", ".join(p.get("categories") or ["N/A"])}'
+                for i, p in enumerate(normalized_products[:5], 1)
+            )
+            productsSummary = f'Found {total_found} products for "{query}":\n{summary_lines}'
 
-        return {
+        result = {
             "items": normalized_products,
             "totalFound": total_found,
             "productsSummary": productsSummary
         }
+        cache = _search_cache if normalized_products else _empty_search_cache
+        cache[cache_key] = copy.deepcopy(result)
+        return result
 
     except Exception as e:
+        if isinstance(e, httpx.TransportError):
+            _search_breaker.record_failure()
         return {
             "items": [],
             "totalFound": 0,
@@ -246,7 +353,7 @@ async def show_cart_tool(config: RunnableConfig, action: str = "view") -> Dict[s
         }
     """
     try:
-        user_id = config.get("configurable", {}).get("thread_id", "default")
+        user_id = _user_id(config)
         items = await cart_service.get_cart(user_id)
         
         return {
@@ -301,7 +408,7 @@ async def add_to_cart_tool(
         image_url (str, optional): URL de l'image principale
     """
     try:
-        user_id = config.get("configurable", {}).get("thread_id", "default")
+        user_id = _user_id(config)
         
         product_data = {
             "id": product_id,
@@ -346,13 +453,12 @@ async def collect_user_info_tool(config: RunnableConfig, field: str, value: str)
         value (str): The value to collect
     """
     try:
-        user_id = config.get("configurable", {}).get("thread_id", "default")
+        user_id = _user_id(config)
         
-        # Validation basique
-        if field == "first_name" and len(value) < 2:
-            return {"success": False, "message": "First name too short"}
-        if field == "phone" and len(value) < 8:
-            return {"success": False, "message": "Phone number too short"}
+        # Validation basique (valeur stockée sans espaces superflus)
+        value, error = _check_user_field(field, value)
+        if error:
+            return {"success": False, "message": error}
         
         # Sauvegarde persistante
         await user_service.save_user_info(user_id, field, value)
@@ -373,19 +479,29 @@ async def process_payment_tool(config: RunnableConfig, first_name: str, phone: s
     Process payment and complete the order.
     """
     try:
-        user_id = config.get("configurable", {}).get("thread_id", "default")
+        user_id = _user_id(config)
+        
+        first_name, error = _check_user_field("first_name", first_name)
+        if not error:
+            phone, error = _check_user_field("phone", phone)
+        if error:
+            return {"success": False, "message": error}
         
-        # 1. Sauvegarder les dernières infos
-        await user_service.save_user_info(user_id, "first_name", first_name)
-        await user_service.save_user_info(user_id, "phone", phone)
+        # 1. Sauvegarder les dernières infos (une seule écriture), en tâche de fond
+        # pendant les opérations panier : requêtes indépendantes
+        save_task = asyncio.create_task(
+            user_service.save_user_fields(user_id, {"first_name": first_name, "phone": phone})
+        )
         
         # 2. Récupérer le panier pour la confirmation (facultatif mais pro)
         cart_items = await cart_service.get_cart(user_id)
         if not cart_items:
+            # Les infos restent enregistrées même sans commande
+            await save_task
             return {"success": False, "message": "Le panier est vide."}
 
-        # 3. Vider le panier après paiement réussi
-        await cart_service.clear_cart(user_id)
+        # 3. Vider le panier après paiement réussi, en parallèle de la sauvegarde
+        await asyncio.gather(save_task, cart_service.clear_cart(user_id))
         
         return {
             "success": True,
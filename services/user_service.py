@@ -1,44 +1,69 @@
 from typing import Dict, Any, Optional
+from cachetools import LRUCache, TTLCache
 from .database import Database
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Fallback en mémoire
-_in_memory_users: Dict[str, Dict[str, Any]] = {}
+# Fallback en mémoire, borné : pendant une panne MongoDB les utilisateurs
+# les moins récemment utilisés sont oubliés au-delà de 10 000
+_in_memory_users: "LRUCache[str, Dict[str, Any]]" = LRUCache(maxsize=10_000)
+
+# Cache court des documents MongoDB lus par get_user, tenu à jour à chaque écriture
+# (write-through) : une conversation relit les mêmes infos à chaque tour
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
 
 class UserService:
     @staticmethod
     async def save_user_info(user_id: str, field: str, value: str) -> bool:
         """Enregistre une information utilisateur (nom, téléphone, etc.)"""
-        db = Database.get_db()
+        return await UserService.save_user_fields(user_id, {field: value})
+
+    @staticmethod
+    async def save_user_fields(user_id: str, fields: Dict[str, Any]) -> bool:
+        """Enregistre plusieurs informations utilisateur en une seule écriture"""
+        db = await Database.get_db()
         
         if db is not None:
             try:
+                now = time.time()
                 await db.user.update_one(
                     {"user_id": user_id},
-                    {"$set": {field: value, "updated_at": time.time()}, "$setOnInsert": {"created_at": time.time()}},
+                    {"$set": {**fields, "updated_at": now}, "$setOnInsert": {"created_at": now}},
                     upsert=True
                 )
+                # Seulement si le document complet est déjà en cache : une entrée
+                # partielle masquerait les champs enregistrés auparavant
+                cached = _user_cache.get(user_id)
+                if cached is not None:
+                    _user_cache[user_id] = {**cached, **fields}
                 return True
             except Exception as e:
-                logger.error(f"Erreur save_user_info MongoDB: {e}")
+                _user_cache.pop(user_id, None)
+                logger.error(f"Erreur save_user_fields MongoDB: {e}")
 
         # Fallback mémoire
         if user_id not in _in_memory_users:
             _in_memory_users[user_id] = {}
         
-        _in_memory_users[user_id][field] = value
+        _in_memory_users[user_id].update(fields)
         return True
 
     @staticmethod
     async def get_user(user_id: str) -> Optional[Dict[str, Any]]:
         """Récupère les informations d'un utilisateur"""
-        db = Database.get_db()
+        db = await Database.get_db()
         if db is not None:
+            cached = _user_cache.get(user_id)
+            if cached is not None:
+                return dict(cached)
             try:
-                return await db.user.find_one({"user_id": user_id})
+                user = await db.user.find_one({"user_id": user_id})
+                if user is not None:
+                    _user_cache[user_id] = user
+                    return dict(user)
+                return None
             except Exception as e:
                 logger.error(f"Erreur get_user MongoDB: {e}")
         